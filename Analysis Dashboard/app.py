@@ -32,9 +32,9 @@ def plot_politics_comments(start_date=None, end_date=None):
     count = 0
     start = None    
     query = """
-        SELECT created_utc FROM politics
-        WHERE created_utc >= %s AND created_utc < %s
-        ORDER BY created_utc;
+        SELECT created_at FROM politics
+        WHERE created_at >= %s AND created_at < %s
+        ORDER BY created_at;
     """
     df = pd.read_sql_query(query, db_conn, params=(start_date, end_date))
     if(df.empty):
@@ -42,7 +42,7 @@ def plot_politics_comments(start_date=None, end_date=None):
         return redirect(url_for('index'))
     else:       
         for index, row in df.iterrows():
-            timestamp = row['created_utc']
+            timestamp = row['created_at']
             if start is None:
                 start = timestamp
                 print(timestamp)
@@ -67,9 +67,9 @@ def plot_politics_comments(start_date=None, end_date=None):
         
         return mpld3.fig_to_html(fig)
 def plot_data_counts(start_date=None, end_date=None):
-    reddit_query = "SELECT COUNT(*) as count FROM comments_for_reddits WHERE created_utc >= %s AND created_utc < %s;"
-    chan_query = "SELECT COUNT(*) as count FROM thread WHERE DATE(timestamp) >= %s AND DATE(timestamp) < %s;"
-    youtube_query = "SELECT COUNT(*) as count FROM yt_comments WHERE comment_time >= %s AND comment_time < %s;"
+    reddit_query = "SELECT COUNT(*) as count FROM comments_for_reddits WHERE created_at >= %s AND created_at < %s;"
+    chan_query = "SELECT COUNT(*) as count FROM thread WHERE created_at >= %s::date AND created_at < %s::date;"
+    youtube_query = "SELECT COUNT(*) as count FROM yt_comments WHERE created_at >= %s AND created_at < %s;"
 
     # Fetch data into DataFrames
     reddit_count = pd.read_sql_query(reddit_query, db_conn, params=(start_date, end_date))['count'].values
@@ -102,12 +102,12 @@ def plot_data_counts(start_date=None, end_date=None):
 
 #Sentiment Analysis
 def chan4_query_database(start_date, end_date):
-    chan4_query_sentiment = f"SELECT s.sentiment, COUNT(*) as count FROM an_4chan s JOIN thread p ON s.postnumber=p.postnumber WHERE TO_CHAR(p.timestamp::date, 'YYYY-MM-DD') BETWEEN '{start_date}' AND '{end_date}' GROUP BY sentiment;"
-    chan4_quer = pd.read_sql(chan4_query_sentiment, db_conn)
+    chan4_query_sentiment = "SELECT s.sentiment, COUNT(*) as count FROM an_4chan s JOIN thread p ON s.postnumber=p.postnumber WHERE p.created_at >= %s::date AND p.created_at < %s::date + 1 GROUP BY sentiment;"
+    chan4_quer = pd.read_sql(chan4_query_sentiment, db_conn, params=(start_date, end_date))
     return chan4_quer
 def reddit_query_database(start_date, end_date):
-    query = f"SELECT s.sentiment, COUNT(*) as count FROM an_r_all_score s JOIN comments_for_reddits p ON s.comment_id=p.comment_id WHERE p.created_utc BETWEEN '{start_date}' AND '{end_date}' GROUP BY sentiment;"
-    result = pd.read_sql(query, db_conn)
+    query = "SELECT s.sentiment, COUNT(*) as count FROM an_r_all_score s JOIN comments_for_reddits p ON s.comment_id=p.comment_id WHERE p.created_at BETWEEN %s AND %s GROUP BY sentiment;"
+    result = pd.read_sql(query, db_conn, params=(start_date, end_date))
     return result
 
 def plot_sentiment_analysis_reddit(sentiment_df):
@@ -149,8 +149,8 @@ def plot_sentiment_analysis_4chan(sentiment_df):
 
 
 def youtube_query_database(start_date, end_date):
-    query = f"SELECT s.sentiment, COUNT(*) as count FROM an_yt1 s JOIN yt_comments p ON s.comment_id=p.comment_id WHERE p.comment_time BETWEEN '{start_date}' AND '{end_date}' GROUP BY sentiment;"
-    result = pd.read_sql(query, db_conn)
+    query = "SELECT s.sentiment, COUNT(*) as count FROM an_yt1 s JOIN yt_comments p ON s.comment_id=p.comment_id WHERE p.created_at BETWEEN %s AND %s GROUP BY sentiment;"
+    result = pd.read_sql(query, db_conn, params=(start_date, end_date))
     return result
 
 def plot_sentiment_analysis_youtube(sentiment_df):
@@ -172,8 +172,8 @@ def plot_sentiment_analysis_youtube(sentiment_df):
         return plot_data_youtube
 
 def politics_query_database(start_date, end_date):
-    query = f"SELECT s.sentiment, COUNT(*) as count FROM an_r_poli_score  s JOIN politics p ON s.comment_id=p.comment_id WHERE p.created_utc BETWEEN '{start_date}' AND '{end_date}' GROUP BY sentiment;"
-    result = pd.read_sql(query, db_conn)
+    query = "SELECT s.sentiment, COUNT(*) as count FROM an_r_poli_score  s JOIN politics p ON s.comment_id=p.comment_id WHERE p.created_at BETWEEN %s AND %s GROUP BY sentiment;"
+    result = pd.read_sql(query, db_conn, params=(start_date, end_date))
     return result
 
 def plot_sentiment_analysis_politics(sentiment_df):
@@ -195,8 +195,8 @@ def plot_sentiment_analysis_politics(sentiment_df):
 
 #HateSpeech Analysis
 def hatespeech_reddit_query_database(start_date, end_date):
-    query = f"SELECT s.is_hate_speech, COUNT(*) as count FROM an_r_all_score s JOIN comments_for_reddits p ON s.comment_id=p.comment_id WHERE p.created_utc BETWEEN '{start_date}' AND '{end_date}' GROUP BY is_hate_speech;"
-    result = pd.read_sql(query, db_conn)
+    query = "SELECT s.is_hate_speech, COUNT(*) as count FROM an_r_all_score s JOIN comments_for_reddits p ON s.comment_id=p.comment_id WHERE p.created_at BETWEEN %s AND %s GROUP BY is_hate_speech;"
+    result = pd.read_sql(query, db_conn, params=(start_date, end_date))
     return result
 
 def plot_hatespeech_analysis_reddit(hate_speech_reddit_df):
@@ -219,8 +219,8 @@ def plot_hatespeech_analysis_reddit(hate_speech_reddit_df):
 
 
 def hatespeech_4chan_query_database(start_date, end_date):
-    query = f"SELECT s.is_hate_speech, COUNT(*) as count FROM an_4chan_score s JOIN thread p ON s.comment_id=p.postnumber WHERE TO_CHAR(p.timestamp::date, 'YYYY-MM-DD') BETWEEN '{start_date}' AND '{end_date}' GROUP BY is_hate_speech;"
-    result = pd.read_sql(query, db_conn)
+    query = "SELECT s.is_hate_speech, COUNT(*) as count FROM an_4chan_score s JOIN thread p ON s.comment_id=p.postnumber WHERE p.created_at >= %s::date AND p.created_at < %s::date + 1 GROUP BY is_hate_speech;"
+    result = pd.read_sql(query, db_conn, params=(start_date, end_date))
     return result
 
 def plot_hatespeech_analysis_4chan(hate_speech_4chan_df):
@@ -241,8 +241,8 @@ def plot_hatespeech_analysis_4chan(hate_speech_4chan_df):
         return plot_hatespeech_data_4chan
 
 def hatespeech_youtube_query_database(start_date, end_date):
-    query = f"SELECT s.is_hate_speech, COUNT(*) as count FROM an_yt1 s JOIN yt_comments p ON s.comment_id=p.comment_id WHERE p.comment_time BETWEEN '{start_date}' AND '{end_date}' GROUP BY is_hate_speech;"
-    result = pd.read_sql(query, db_conn)
+    query = "SELECT s.is_hate_speech, COUNT(*) as count FROM an_yt1 s JOIN yt_comments p ON s.comment_id=p.comment_id WHERE p.created_at BETWEEN %s AND %s GROUP BY is_hate_speech;"
+    result = pd.read_sql(query, db_conn, params=(start_date, end_date))
     return result
 
 def plot_hatespeech_analysis_youtube(hate_speech_youtube_df):
@@ -262,8 +262,8 @@ def plot_hatespeech_analysis_youtube(hate_speech_youtube_df):
         plt.close()
         return plot_hatespeech_data_youtube
 def hatespeech_politics_query_database(start_date, end_date):
-    query = f"SELECT s.is_hate_speech, COUNT(*) as count FROM an_r_poli_score  s JOIN politics p ON s.comment_id=p.comment_id WHERE p.created_utc BETWEEN '{start_date}' AND '{end_date}' GROUP BY is_hate_speech;"
-    result = pd.read_sql(query, db_conn)
+    query = "SELECT s.is_hate_speech, COUNT(*) as count FROM an_r_poli_score  s JOIN politics p ON s.comment_id=p.comment_id WHERE p.created_at BETWEEN %s AND %s GROUP BY is_hate_speech;"
+    result = pd.read_sql(query, db_conn, params=(start_date, end_date))
     return result
 
 def plot_hatespeech_analysis_politics(hate_speech_politics_df):
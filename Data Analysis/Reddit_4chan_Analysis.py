@@ -1,11 +1,17 @@
 import logging
 import psycopg2
 from psycopg2 import sql
-import requests
-import re
-from nltk.sentiment import SentimentIntensityAnalyzer
 import nltk
 from config2 import DB_CONFIG,OLD_TABLE_NAME,NEW_TABLE_NAME, TABLE_FIELDS, MODERATE_HATE_SPEECH_API_TOKEN
+import argparse
+from analysis_db import ALL_SHARDS, ensure_checkpoint_table, iter_chunks, load_checkpoint, lock_setup, parse_shard, shard_key
+from db import ensure_column
+from result_writer import ResultWriter, commit_batch
+from sentiment_engine import SentimentEngine
+from analysis_cache import analyze_comments, ensure_cache_table
+from text_normalize import clean_comments, identify_languages
+from collections import Counter
+from metrics import metrics, sample
 
 # Download VADER lexicon
 nltk.download('vader_lexicon')
@@ -13,54 +19,7 @@ nltk.download('vader_lexicon')
 # Configure logging
 logging.basicConfig(filename='script1.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-c = 0
-
-def hs_check_comment(comment):
-    CONF_THRESHOLD = 0.9
-
-    data = {
-        "token": MODERATE_HATE_SPEECH_API_TOKEN,
-        "text": comment
-    }
-
-    try:
-        response = requests.post("https://api.moderatehatespeech.com/api/v1/moderate/", json=data)
-        response.raise_for_status()  # Check for HTTP errors
-
-        # Skip empty responses
-        if not response.text:
-            logging.warning("Empty JSON response, skipping.")
-            return False, None
-
-        try:
-            response_json = response.json()
-
-            # Check if the expected keys are present in the response
-            class_value = response_json.get("class")
-            confidence_value = response_json.get("confidence")
-
-            if class_value == "flag" and confidence_value is not None and float(confidence_value) > CONF_THRESHOLD:
-                logging.info("Hate speech detected: %s with confidence %s", comment, confidence_value)
-                return True, confidence_value
-            return False, confidence_value
-
-        except requests.exceptions.JSONDecodeError:
-            logging.error(f"Failed to decode JSON response: {response.text}")
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request failed: {e}")
-
-    return False, None
-
-def clean_comment(comment):
-    # Remove both http and https links from the comment
-    comment_without_links = re.sub(r'https?://\S+', '', comment)
-
-    # Implement your additional comment cleaning logic here
-    # Example: Remove special characters and convert to lowercase
-    cleaned_comment = re.sub(r'[^a-zA-Z0-9\s]', '', comment_without_links).lower()
-
-    return cleaned_comment
+RESULT_COLUMNS = ('comment_id', 'original_comment', 'cleaned_comment', 'is_hate_speech', 'hate_speech_confidence', 'sentiment', 'sentiment_score', 'language')
 
 def create_table(cursor, table_name):
     create_table_query = sql.SQL("""
@@ -76,91 +35,98 @@ def create_table(cursor, table_name):
     """).format(sql.Identifier(table_name))
     cursor.execute(create_table_query)
 
-def is_comment_id_present(cursor, table_name, comment_id):
-    select_query = sql.SQL("SELECT EXISTS(SELECT 1 FROM {} WHERE comment_id = %s)").format(
-        sql.Identifier(table_name)
-    )
-    cursor.execute(select_query, (comment_id,))
-    return cursor.fetchone()[0]
-
 # ... (rest of the script)
 
-def process_comments():
-    # Connect to the PostgreSQL database
+def process_comments(source_table=OLD_TABLE_NAME, target_table=NEW_TABLE_NAME, shard=ALL_SHARDS):
+    # Connect to the PostgreSQL database; reads stream over their own connection so that
+    # committing the results does not close the server-side cursor
     connection = psycopg2.connect(**DB_CONFIG)
+    read_connection = psycopg2.connect(**DB_CONFIG)
     cursor = connection.cursor()
 
+    # The shared result cache is read and written outside the result batches, so parallel
+    # workers never hold locks on each other's cache rows until their batch commits
+    cache_connection = psycopg2.connect(**DB_CONFIG)
+    cache_connection.autocommit = True
+    cache_cursor = cache_connection.cursor()
+
     # Create the new table if not exists
-    create_table(cursor, NEW_TABLE_NAME)
+    lock_setup(cursor)
+    create_table(cursor, target_table)
+    ensure_column(cursor, target_table, 'language', 'TEXT')
+    ensure_checkpoint_table(cursor)
+    ensure_cache_table(cursor)
 
     # Select comments from the old table (4chan or Reddit)
-    table_fields = TABLE_FIELDS.get(OLD_TABLE_NAME, None)
+    table_fields = TABLE_FIELDS.get(source_table, None)
 
     if table_fields is None:
-        logging.error("Table fields not defined for table: %s", OLD_TABLE_NAME)
+        logging.error("Table fields not defined for table: %s", source_table)
         return
 
     id_field = table_fields["id_field"]
     text_field = table_fields["text_field"]
 
-    select_query = sql.SQL("SELECT {}, {} FROM {}").format(
-        sql.Identifier(id_field),
-        sql.Identifier(text_field),
-        sql.Identifier(OLD_TABLE_NAME)
-    )
+    writer = ResultWriter(connection, target_table, RESULT_COLUMNS)
+
+    # Resume after the last source row a previous run got through; comments analyzed before
+    # checkpoints existed are excluded by the anti-join in the select
+    last_id = load_checkpoint(cursor, source_table, target_table, shard)
 
-    cursor.execute(select_query)
-    comments = cursor.fetchall()
+    # Committed only now: an open transaction still holding the results table would block
+    # another shard's setup, which in turn blocks this shard's read cursor
+    connection.commit()
 
-    # Clean, check for hate speech, and update comments into the new table
-    for comment_id, comment_text in comments:
-        if is_comment_id_present(cursor, NEW_TABLE_NAME, comment_id):
-            logging.info("Comment ID %s already present, skipping.", comment_id)
-            continue
+    metrics.job = f"{metrics.job}_{source_table}_{shard[0]}of{shard[1]}"
 
-        cleaned_comment = clean_comment(comment_text)
+    # Clean, check for hate speech, and update comments into the new table, one chunk at a time
+    with SentimentEngine() as engine:
+        for chunk in iter_chunks(read_connection, source_table, (id_field, text_field), last_id, target_table, shard):
+            comment_texts = [comment_text for _, _, comment_text in chunk]
+            metrics.add_rows('fetch', len(chunk))
+            with metrics.timer('clean'):
+                cleaned_comments = clean_comments(comment_texts)
+            metrics.add_rows('clean', len(chunk))
 
-        is_hate_speech, confidence_value = hs_check_comment(cleaned_comment)
+            # Language is detected on the raw text, since cleaning drops every non-ASCII letter
+            with metrics.timer('language'):
+                languages, scored_flags = identify_languages(comment_texts)
+            metrics.add_rows('language', len(chunk))
 
-        # Analyze sentiment
-        sentiment, sentiment_score = analyze_sentiment(cleaned_comment)
+            # Analyze sentiment and check for hate speech for the whole chunk; texts already in
+            # the result cache and comments confidently in other languages are not scored
+            results = analyze_comments(cache_cursor, engine, cleaned_comments, MODERATE_HATE_SPEECH_API_TOKEN, scored_flags)
 
-        insert_query = sql.SQL("""
-            INSERT INTO {} (comment_id, original_comment, cleaned_comment, is_hate_speech, hate_speech_confidence, sentiment, sentiment_score)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """).format(sql.Identifier(NEW_TABLE_NAME))
+            for (_, comment_id, comment_text), cleaned_comment, language, (sentiment, sentiment_score, is_hate_speech, confidence_value) in zip(
+                    chunk, cleaned_comments, languages, results):
+                if sample():
+                    logging.info("Sentiment %s (sampled): %s with score %s", sentiment, cleaned_comment, sentiment_score)
 
-        cursor.execute(insert_query, (comment_id, comment_text, cleaned_comment, is_hate_speech, confidence_value, sentiment, sentiment_score))
+                writer.add((comment_id, comment_text, cleaned_comment, is_hate_speech, confidence_value, sentiment, sentiment_score, language))
+            last_id = chunk[-1][0]
+            logging.info("Analyzed %d comments up to id %s: %s", len(chunk), last_id,
+                         dict(Counter(result[0] for result in results)))
 
-        # Insert records into the new table after every count of 1000
-        if c % 1000 == 0:
-            connection.commit()
+            # Results and the checkpoint are committed together every RESULT_BATCH_SIZE rows
+            if writer.full():
+                commit_batch(connection, writer, source_table, target_table, last_id, shard)
 
-    # Commit any remaining changes and close the connection
-    connection.commit()
+    commit_batch(connection, writer, source_table, target_table, last_id, shard)
+
+    logging.info("Metrics written to %s - %s", metrics.write(), metrics.summary())
+
+    # Close the connections
+    cache_connection.close()
+    read_connection.close()
     connection.close()
 
 # ... (rest of the script)
 
-def analyze_sentiment(comment):
-    # Check if the comment is a string
-    if isinstance(comment, str):
-        analyzer = SentimentIntensityAnalyzer()
-        sentiment_scores = analyzer.polarity_scores(comment)
-
-        # Classify the sentiment
-        if sentiment_scores['compound'] >= 0.05:
-            logging.info("Positive sentiment detected: %s with score %s", comment, sentiment_scores['compound'])
-            return 'positive', sentiment_scores['compound']
-        elif sentiment_scores['compound'] <= -0.05:
-            logging.info("Negative sentiment detected: %s with score %s", comment, sentiment_scores['compound'])
-            return 'negative', sentiment_scores['compound']
-        else:
-            logging.info("Neutral sentiment detected: %s with score %s", comment, sentiment_scores['compound'])
-            return 'neutral', sentiment_scores['compound']
-    else:
-        # Handle non-string values (e.g., float)
-        return 'not a string', None
-
 if __name__ == "__main__":
-    process_comments()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source-table', default=OLD_TABLE_NAME)
+    parser.add_argument('--target-table', default=NEW_TABLE_NAME)
+    parser.add_argument('--shard', type=parse_shard, default=ALL_SHARDS, help='k/N: analyze the comments whose id hashes to k modulo N')
+    args = parser.parse_args()
+    logging.info("Analyzing %s into %s, shard %s", args.source_table, args.target_table, shard_key(args.shard))
+    process_comments(args.source_table, args.target_table, args.shard)
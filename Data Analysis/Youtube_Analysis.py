@@ -1,11 +1,17 @@
 import logging
 import psycopg2
 from psycopg2 import sql
-import requests
-import re
-from nltk.sentiment import SentimentIntensityAnalyzer
 import nltk
 from config import DB_CONFIG, OLD_TABLE_CONFIG, NEW_TABLE_CONFIG, MODERATE_HATE_SPEECH_API_TOKEN
+import argparse
+from analysis_db import ALL_SHARDS, ensure_checkpoint_table, iter_chunks, load_checkpoint, lock_setup, parse_shard, shard_key
+from db import ensure_column, ensure_unique_index
+from result_writer import ResultWriter, commit_batch
+from sentiment_engine import SentimentEngine
+from analysis_cache import analyze_comments, ensure_cache_table
+from text_normalize import clean_comments, identify_languages
+from collections import Counter
+from metrics import metrics, sample
 
 # Download VADER lexicon
 nltk.download('vader_lexicon')
@@ -13,54 +19,7 @@ nltk.download('vader_lexicon')
 # Configure logging
 logging.basicConfig(filename='script.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-c = 0
-
-def hs_check_comment(comment):
-    CONF_THRESHOLD = 0.9
-
-    data = {
-        "token": MODERATE_HATE_SPEECH_API_TOKEN,
-        "text": comment
-    }
-
-    try:
-        response = requests.post("https://api.moderatehatespeech.com/api/v1/moderate/", json=data)
-        response.raise_for_status()  # Check for HTTP errors
-
-        # Skip empty responses
-        if not response.text:
-            logging.warning("Empty JSON response, skipping.")
-            return False
-
-        try:
-            response_json = response.json()
-
-            # Check if the expected keys are present in the response
-            class_value = response_json.get("class")
-            confidence_value = response_json.get("confidence")
-
-            if class_value == "flag" and confidence_value is not None and float(confidence_value) > CONF_THRESHOLD:
-                logging.info("Hate speech detected: %s", comment)
-                return True
-            return False
-
-        except requests.exceptions.JSONDecodeError:
-            logging.error(f"Failed to decode JSON response: {response.text}")
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request failed: {e}")
-
-    return False
-
-def clean_comment(comment):
-    # Remove both http and https links from the comment
-    comment_without_links = re.sub(r'https?://\S+', '', comment)
-
-    # Implement your additional comment cleaning logic here
-    # Example: Remove special characters and convert to lowercase
-    cleaned_comment = re.sub(r'[^a-zA-Z0-9\s]', '', comment_without_links).lower()
-
-    return cleaned_comment
+RESULT_COLUMNS = ('comment_id', 'video_id', 'original_comment', 'cleaned_comment', 'is_hate_speech', 'sentiment', 'language')
 
 def create_table(cursor, table_name, columns):
     # Construct column definitions with data types
@@ -82,83 +41,92 @@ def create_table(cursor, table_name, columns):
     cursor.execute(create_table_query)
 
 
-def is_comment_id_present(cursor, table_name, comment_id):
-    select_query = sql.SQL("SELECT EXISTS(SELECT 1 FROM {} WHERE comment_id = %s)").format(
-        sql.Identifier(table_name)
-    )
-    cursor.execute(select_query, (comment_id,))
-    return cursor.fetchone()[0]
-
-def process_comments():
-    # Connect to the PostgreSQL database
+def process_comments(source_table=OLD_TABLE_CONFIG["name"], target_table=NEW_TABLE_CONFIG["name"], shard=ALL_SHARDS):
+    # Connect to the PostgreSQL database; reads stream over their own connection so that
+    # committing the results does not close the server-side cursor
     connection = psycopg2.connect(**DB_CONFIG)
+    read_connection = psycopg2.connect(**DB_CONFIG)
     cursor = connection.cursor()
 
-    # Create the new table if not exists
-    create_table(cursor, NEW_TABLE_CONFIG["name"], NEW_TABLE_CONFIG["columns"])
-
-    # Select comments from the old table
-    select_query = sql.SQL("SELECT {} FROM {}").format(
-        sql.SQL(', ').join(map(sql.Identifier, OLD_TABLE_CONFIG["columns"])),
-        sql.Identifier(OLD_TABLE_CONFIG["name"])
-    )
-    cursor.execute(select_query)
-    comments = cursor.fetchall()
-
-    # Clean, check for hate speech, and update comments into the new table
-    for comment_data in comments:
-        # Extract relevant fields based on the configuration
-        comment_id = comment_data[0]
-        video_id = comment_data[1]
-        comment_text = comment_data[2]
-
-        if is_comment_id_present(cursor, NEW_TABLE_CONFIG["name"], comment_id):
-            logging.info("Comment ID %s already present, skipping.", comment_id)
-            continue
-
-        # Implement your additional comment cleaning logic here
-        cleaned_comment = clean_comment(comment_text)
-
-        is_hate_speech = hs_check_comment(cleaned_comment)
-
-        # Analyze sentiment
-        sentiment = analyze_sentiment(cleaned_comment)
-
-        # Insert into the new table
-        insert_query = sql.SQL("""
-            INSERT INTO {} ("comment_id", "video_id", "original_comment", "cleaned_comment", "is_hate_speech", "sentiment")
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """).format(sql.Identifier(NEW_TABLE_CONFIG["name"]))
-
-        values = (comment_id, video_id, comment_text, cleaned_comment, is_hate_speech, sentiment)
-        cursor.execute(insert_query, values)
-
-        # Insert records into the new table after every count of 1000
-        if c % 1000 == 0:
-            connection.commit()
+    # The shared result cache is read and written outside the result batches, so parallel
+    # workers never hold locks on each other's cache rows until their batch commits
+    cache_connection = psycopg2.connect(**DB_CONFIG)
+    cache_connection.autocommit = True
+    cache_cursor = cache_connection.cursor()
 
+    # Create the new table if not exists
+    lock_setup(cursor)
+    create_table(cursor, target_table, NEW_TABLE_CONFIG["columns"])
+    ensure_column(cursor, target_table, 'language', 'TEXT')
+    # ON CONFLICT in the result writer needs a unique index on comment_id
+    ensure_unique_index(cursor, target_table, ('comment_id',))
+    ensure_checkpoint_table(cursor)
+    ensure_cache_table(cursor)
+
+    # Insert into the new table
+    writer = ResultWriter(connection, target_table, RESULT_COLUMNS)
+
+    # Resume after the last source row a previous run got through; comments analyzed before
+    # checkpoints existed are excluded by the anti-join in the select
+    last_id = load_checkpoint(cursor, source_table, target_table, shard)
+
+    # Committed only now: an open transaction still holding the results table would block
+    # another shard's setup, which in turn blocks this shard's read cursor
     connection.commit()
-    connection.close()
 
-def analyze_sentiment(comment):
-    # Check if the comment is a string
-    if isinstance(comment, str):
-        analyzer = SentimentIntensityAnalyzer()
-        sentiment_scores = analyzer.polarity_scores(comment)
-
-        # Classify the sentiment
-        if sentiment_scores['compound'] >= 0.05:
-            logging.info("Positive sentiment detected: %s", comment)
-            return 'positive'
-        elif sentiment_scores['compound'] <= -0.05:
-            logging.info("Negative sentiment detected: %s", comment)
-            return 'negative'
-        else:
-            logging.info("Neutral sentiment detected: %s", comment)
-            return 'neutral'
-    else:
-        # Handle non-string values (e.g., float)
-        return 'not a string'
+    metrics.job = f"{metrics.job}_{source_table}_{shard[0]}of{shard[1]}"
+
+    # Clean, check for hate speech, and update comments into the new table, one chunk at a time
+    with SentimentEngine() as engine:
+        for chunk in iter_chunks(read_connection, source_table, OLD_TABLE_CONFIG["columns"], last_id, target_table, shard):
+            # Fields follow the configuration, after the streaming key
+            comment_texts = [comment_data[3] for comment_data in chunk]
+            metrics.add_rows('fetch', len(chunk))
+            with metrics.timer('clean'):
+                cleaned_comments = clean_comments(comment_texts)
+            metrics.add_rows('clean', len(chunk))
+
+            # Language is detected on the raw text, since cleaning drops every non-ASCII letter
+            with metrics.timer('language'):
+                languages, scored_flags = identify_languages(comment_texts)
+            metrics.add_rows('language', len(chunk))
+
+            # Analyze sentiment and check for hate speech for the whole chunk; texts already in
+            # the result cache and comments confidently in other languages are not scored
+            results = analyze_comments(cache_cursor, engine, cleaned_comments, MODERATE_HATE_SPEECH_API_TOKEN, scored_flags)
+
+            for comment_data, cleaned_comment, language, (sentiment, _, is_hate_speech, _) in zip(
+                    chunk, cleaned_comments, languages, results):
+                comment_id = comment_data[1]
+                video_id = comment_data[2]
+                comment_text = comment_data[3]
+                if sample():
+                    logging.info("Sentiment %s (sampled): %s", sentiment, cleaned_comment)
+
+                values = (comment_id, video_id, comment_text, cleaned_comment, is_hate_speech, sentiment, language)
+                writer.add(values)
+            last_id = chunk[-1][0]
+            logging.info("Analyzed %d comments up to id %s: %s", len(chunk), last_id,
+                         dict(Counter(result[0] for result in results)))
+
+            # Results and the checkpoint are committed together every RESULT_BATCH_SIZE rows
+            if writer.full():
+                commit_batch(connection, writer, source_table, target_table, last_id, shard)
+
+    commit_batch(connection, writer, source_table, target_table, last_id, shard)
+
+    logging.info("Metrics written to %s - %s", metrics.write(), metrics.summary())
+
+    # Close the connections
+    cache_connection.close()
+    read_connection.close()
+    connection.close()
 
 if __name__ == "__main__":
-    process_comments()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source-table', default=OLD_TABLE_CONFIG["name"])
+    parser.add_argument('--target-table', default=NEW_TABLE_CONFIG["name"])
+    parser.add_argument('--shard', type=parse_shard, default=ALL_SHARDS, help='k/N: analyze the comments whose id hashes to k modulo N')
+    args = parser.parse_args()
+    logging.info("Analyzing %s into %s, shard %s", args.source_table, args.target_table, shard_key(args.shard))
+    process_comments(args.source_table, args.target_table, args.shard)
@@ -0,0 +1,138 @@
+import os
+import time
+import logging
+import hashlib
+import psycopg2
+from psycopg2 import errors
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from hate_speech_client import check_comments
+from metrics import metrics
+
+# Results keyed by a hash of the cleaned text, shared by every analysis script and platform, so
+# a copypasta or a one-word reply is scored and sent to the hate-speech API once. Least recently
+# used entries are deleted once the table grows past ANALYSIS_CACHE_MAX_ENTRIES, by the DAG's
+# housekeeping task rather than by every analysis worker.
+ANALYSIS_CACHE_TABLE = 'analysis_cache'
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '2000000'))
+DEADLOCK_RETRIES = 3
+SKIPPED = (None, None, None, None)
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def ensure_cache_table(cursor):
+    cursor.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {} (
+            text_hash BYTEA PRIMARY KEY,
+            sentiment TEXT,
+            sentiment_score DOUBLE PRECISION,
+            is_hate_speech BOOLEAN,
+            hate_speech_confidence DOUBLE PRECISION,
+            last_used TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """).format(sql.Identifier(ANALYSIS_CACHE_TABLE)))
+    cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (last_used)").format(
+        sql.Identifier(f"{ANALYSIS_CACHE_TABLE}_last_used_idx"),
+        sql.Identifier(ANALYSIS_CACHE_TABLE)
+    ))
+
+
+def retry_on_deadlock(function, *args):
+    # Workers share hot rows ('lol', ''); rows are locked in text_hash order so they should
+    # not deadlock, but a statement the server still aborts is simply run again
+    for attempt in range(DEADLOCK_RETRIES):
+        try:
+            return function(*args)
+        except errors.DeadlockDetected:
+            if attempt == DEADLOCK_RETRIES - 1:
+                raise
+            metrics.inc('cache_deadlocks')
+            logging.warning("Deadlock on %s, retrying", ANALYSIS_CACHE_TABLE)
+            time.sleep(0.1 * (attempt + 1))
+
+
+def lookup_results(cursor, texts):
+    # Returns {text: (sentiment, sentiment_score, is_hate_speech, hate_speech_confidence)} for
+    # the texts already in the cache, marking them as used in the same statement
+    hashes = {text_hash(text): text for text in texts}
+    if not hashes:
+        return {}
+    cursor.execute(sql.SQL("""
+        WITH locked AS (
+            SELECT text_hash FROM {table} WHERE text_hash = ANY(%s) ORDER BY text_hash FOR UPDATE
+        )
+        UPDATE {table} c SET last_used = now() FROM locked WHERE c.text_hash = locked.text_hash
+        RETURNING c.text_hash, c.sentiment, c.sentiment_score, c.is_hate_speech, c.hate_speech_confidence
+    """).format(table=sql.Identifier(ANALYSIS_CACHE_TABLE)), ([psycopg2.Binary(h) for h in sorted(hashes)],))
+    return {hashes[bytes(row[0])]: tuple(row[1:]) for row in cursor.fetchall()}
+
+
+def store_results(cursor, results):
+    # results: {text: (sentiment, sentiment_score, is_hate_speech, hate_speech_confidence)}
+    rows = sorted((text_hash(text),) + tuple(result) for text, result in results.items())
+    if not rows:
+        return
+    execute_values(cursor, sql.SQL("""
+        INSERT INTO {} (text_hash, sentiment, sentiment_score, is_hate_speech, hate_speech_confidence)
+        VALUES %s ON CONFLICT (text_hash) DO UPDATE SET last_used = now()
+    """).format(sql.Identifier(ANALYSIS_CACHE_TABLE)).as_string(cursor),
+        [(psycopg2.Binary(row[0]),) + row[1:] for row in rows])
+
+
+def evict(cursor, max_entries=ANALYSIS_CACHE_MAX_ENTRIES):
+    cursor.execute(sql.SQL("""
+        DELETE FROM {table} WHERE text_hash IN (
+            SELECT text_hash FROM {table} ORDER BY last_used DESC OFFSET %s
+        )
+    """).format(table=sql.Identifier(ANALYSIS_CACHE_TABLE)), (max_entries,))
+    return cursor.rowcount
+
+
+def analyze_comments(cursor, engine, cleaned_comments, token, scored_flags=None):
+    # (sentiment, sentiment_score, is_hate_speech, hate_speech_confidence) per comment, in
+    # order; only texts that are neither cached nor repeated earlier in the batch get scored.
+    # Comments flagged False (confidently in a language we do not score) get an all-None
+    # result without any work.
+    if scored_flags is not None:
+        scored = [text for text, flag in zip(cleaned_comments, scored_flags) if flag]
+    else:
+        scored = cleaned_comments
+    with metrics.timer('cache'):
+        results = retry_on_deadlock(lookup_results, cursor, scored)
+    misses = [text for text in dict.fromkeys(scored) if text not in results]
+    metrics.inc('cache_hits', len(scored) - len(misses))
+    metrics.inc('cache_misses', len(misses))
+    metrics.inc('skipped_language', len(cleaned_comments) - len(scored))
+    if misses:
+        with metrics.timer('score'):
+            sentiments, sentiment_scores = engine.score(misses)
+        metrics.add_rows('score', len(misses))
+        with metrics.timer('classify'):
+            hate_speech_results = check_comments(misses, token)
+        metrics.add_rows('classify', len(misses))
+        fresh = {}
+        for text, sentiment, sentiment_score, (is_hate_speech, confidence_value) in zip(
+                misses, sentiments, sentiment_scores, hate_speech_results):
+            confidence_value = float(confidence_value) if confidence_value is not None else None
+            results[text] = (sentiment, sentiment_score, is_hate_speech, confidence_value)
+            # A failed API call has no confidence; leave it out so it is retried next time
+            if confidence_value is not None:
+                fresh[text] = results[text]
+        retry_on_deadlock(store_results, cursor, fresh)
+    if scored_flags is not None:
+        return [results[text] if flag else SKIPPED for text, flag in zip(cleaned_comments, scored_flags)]
+    return [results[text] for text in cleaned_comments]
+
+
+if __name__ == '__main__':
+    # Housekeeping task: trim the cache once per DAG run, after the analysis workers are done
+    from config import DB_CONFIG
+    logging.basicConfig(level=logging.INFO)
+    connection = psycopg2.connect(**DB_CONFIG)
+    with connection, connection.cursor() as cursor:
+        ensure_cache_table(cursor)
+        logging.info("Evicted %d entries from %s", evict(cursor), ANALYSIS_CACHE_TABLE)
+    connection.close()
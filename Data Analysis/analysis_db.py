@@ -0,0 +1,97 @@
+import os
+import argparse
+from itertools import islice
+from psycopg2 import sql
+
+# Rows pulled from the server per network round trip, and rows processed/committed together
+ANALYSIS_ITERSIZE = int(os.getenv('ANALYSIS_ITERSIZE', '2000'))
+ANALYSIS_CHUNK_SIZE = int(os.getenv('ANALYSIS_CHUNK_SIZE', '1000'))
+
+# Every raw table has a serial id that only grows as rows are ingested, so it doubles as the
+# keyset for streaming and as the resume point stored per (source, target, shard)
+KEY_COLUMN = 'id'
+CHECKPOINT_TABLE = 'analysis_checkpoints'
+
+# (k, N): this worker takes the comments whose id hashes to k modulo N
+ALL_SHARDS = (0, 1)
+
+
+def parse_shard(value):
+    # argparse type for --shard k/N
+    try:
+        k, n = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected k/N, got {value!r}")
+    if n < 1 or not 0 <= k < n:
+        raise argparse.ArgumentTypeError(f"shard {value!r} needs 0 <= k < N")
+    return k, n
+
+
+def shard_key(shard):
+    return f"{shard[0]}/{shard[1]}"
+
+
+def lock_setup(cursor):
+    # Parallel workers start together; serialize their CREATE/ALTER statements until commit
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (CHECKPOINT_TABLE,))
+
+
+def ensure_checkpoint_table(cursor):
+    cursor.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {} (
+            source_table TEXT NOT NULL,
+            target_table TEXT NOT NULL,
+            shard TEXT NOT NULL,
+            last_id BIGINT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (source_table, target_table, shard)
+        )
+    """).format(sql.Identifier(CHECKPOINT_TABLE)))
+
+
+def load_checkpoint(cursor, source_table, target_table, shard=ALL_SHARDS):
+    cursor.execute(sql.SQL("SELECT last_id FROM {} WHERE source_table = %s AND target_table = %s AND shard = %s").format(
+        sql.Identifier(CHECKPOINT_TABLE)
+    ), (source_table, target_table, shard_key(shard)))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def save_checkpoint(cursor, source_table, target_table, last_id, shard=ALL_SHARDS):
+    cursor.execute(sql.SQL("""
+        INSERT INTO {} (source_table, target_table, shard, last_id) VALUES (%s, %s, %s, %s)
+        ON CONFLICT (source_table, target_table, shard)
+        DO UPDATE SET last_id = GREATEST({}.last_id, EXCLUDED.last_id), updated_at = now()
+    """).format(sql.Identifier(CHECKPOINT_TABLE), sql.Identifier(CHECKPOINT_TABLE)),
+        (source_table, target_table, shard_key(shard), last_id))
+
+
+def iter_chunks(connection, table_name, columns, after_id=0, results_table=None, shard=ALL_SHARDS,
+                itersize=ANALYSIS_ITERSIZE, chunk_size=ANALYSIS_CHUNK_SIZE):
+    # Streams (id, *columns) rows with a server-side cursor so memory stays flat however large
+    # the table is. Use a connection dedicated to reading: committing on it would close the cursor.
+    # With results_table, rows whose first column already appears there as comment_id are
+    # filtered out by the database (an anti-join) instead of being checked one by one. A shard
+    # (k, N) keeps only the rows whose first column hashes to k, so N workers split the table.
+    select_query = sql.SQL("SELECT s.{key}, {columns} FROM {table} s WHERE s.{key} > %s {unanalyzed} {sharded} ORDER BY s.{key}").format(
+        key=sql.Identifier(KEY_COLUMN),
+        columns=sql.SQL(', ').join(sql.SQL('s.{}').format(sql.Identifier(column)) for column in columns),
+        table=sql.Identifier(table_name),
+        unanalyzed=sql.SQL("AND NOT EXISTS (SELECT 1 FROM {} r WHERE r.comment_id = s.{}::text)").format(
+            sql.Identifier(results_table), sql.Identifier(columns[0])
+        ) if results_table else sql.SQL(''),
+        sharded=sql.SQL("AND mod(abs(hashtext(s.{}::text)::bigint), {}) = {}").format(
+            sql.Identifier(columns[0]), sql.Literal(shard[1]), sql.Literal(shard[0])
+        ) if shard[1] > 1 else sql.SQL('')
+    )
+    with connection.cursor(name=f"{table_name}_stream") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(select_query, (after_id,))
+        rows = iter(cursor)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+    # End the read transaction so its locks are not held while the caller finishes up
+    connection.rollback()
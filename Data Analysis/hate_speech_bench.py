@@ -0,0 +1,55 @@
+import sys
+import time
+import asyncio
+import threading
+import requests
+from aiohttp import web
+from mock_hate_speech_server import API_PATH, make_app
+from hate_speech_client import check_comments
+
+PORT = 8089
+LATENCY_MS = 50
+COMMENTS = 500
+SEQUENTIAL_SAMPLE = 50
+
+
+def serve(app, ready):
+    # The mock server gets its own thread and loop so the blocking baseline can call it too
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', PORT).start())
+    ready.set()
+    loop.run_forever()
+
+
+def sequential(url, comments):
+    # What hs_check_comment used to do: one blocking request per comment
+    return [requests.post(url, json={"token": "bench", "text": comment}).json() for comment in comments]
+
+
+def main():
+    error_rate = float(sys.argv[1]) if len(sys.argv) > 1 else 0.0
+    ready = threading.Event()
+    threading.Thread(target=serve, args=(make_app(LATENCY_MS, error_rate=error_rate), ready), daemon=True).start()
+    ready.wait()
+    url = f"http://127.0.0.1:{PORT}{API_PATH}"
+    comments = [f"comment {i} {'i hate this' if i % 10 == 0 else 'nice'}" for i in range(COMMENTS)]
+
+    start = time.perf_counter()
+    sequential(url, comments[:SEQUENTIAL_SAMPLE])
+    blocking = (time.perf_counter() - start) / SEQUENTIAL_SAMPLE
+
+    start = time.perf_counter()
+    results = check_comments(comments, "bench", url=url, rate_per_sec=0)
+    concurrent = (time.perf_counter() - start) / COMMENTS
+
+    flagged = sum(1 for is_hate_speech, _ in results if is_hate_speech)
+    print(f"{COMMENTS} comments at {LATENCY_MS}ms latency, error rate {error_rate}: {flagged} flagged")
+    print(f"blocking requests: {1 / blocking:,.0f} comments/s")
+    print(f"async client:      {1 / concurrent:,.0f} comments/s")
+    print(f"Speedup:           {blocking / concurrent:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+from metrics import metrics, sample
+
+MODERATE_HATE_SPEECH_API_URL = os.getenv('MODERATE_HATE_SPEECH_API_URL', 'https://api.moderatehatespeech.com/api/v1/moderate/')
+HATE_SPEECH_CONCURRENCY = int(os.getenv('HATE_SPEECH_CONCURRENCY', '16'))
+HATE_SPEECH_RATE_PER_SEC = float(os.getenv('HATE_SPEECH_RATE_PER_SEC', '20'))
+HATE_SPEECH_MAX_RETRIES = int(os.getenv('HATE_SPEECH_MAX_RETRIES', '5'))
+HATE_SPEECH_BACKOFF_SEC = float(os.getenv('HATE_SPEECH_BACKOFF_SEC', '0.5'))
+HATE_SPEECH_TIMEOUT_SEC = float(os.getenv('HATE_SPEECH_TIMEOUT_SEC', '30'))
+
+CONF_THRESHOLD = 0.9
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AsyncTokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def classify_response(response_json):
+    # (is_hate_speech, confidence) exactly as hs_check_comment decided it
+    class_value = response_json.get("class")
+    confidence_value = response_json.get("confidence")
+    if class_value == "flag" and confidence_value is not None and float(confidence_value) > CONF_THRESHOLD:
+        return True, confidence_value
+    return False, confidence_value
+
+
+class HateSpeechClient:
+    def __init__(self, token, url=MODERATE_HATE_SPEECH_API_URL, concurrency=HATE_SPEECH_CONCURRENCY,
+                 rate_per_sec=HATE_SPEECH_RATE_PER_SEC, max_retries=HATE_SPEECH_MAX_RETRIES):
+        self.token = token
+        self.url = url
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.rate_per_sec = rate_per_sec
+        self.semaphore = None
+        self.bucket = None
+        self.session = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.bucket = AsyncTokenBucket(self.rate_per_sec) if self.rate_per_sec > 0 else None
+        # One keep-alive connection per in-flight request, reused for the whole batch
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=HATE_SPEECH_TIMEOUT_SEC)
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def _backoff(self, attempt, retry_after=None):
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = HATE_SPEECH_BACKOFF_SEC * 2 ** attempt
+        await asyncio.sleep(delay + random.uniform(0, HATE_SPEECH_BACKOFF_SEC))
+
+    async def check(self, comment):
+        data = {"token": self.token, "text": comment}
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                if self.bucket is not None:
+                    await self.bucket.acquire()
+                start = time.perf_counter()
+                try:
+                    async with self.session.post(self.url, json=data) as response:
+                        metrics.observe('moderatehatespeech', time.perf_counter() - start)
+                        metrics.inc(f"moderatehatespeech_http_{response.status}")
+                        if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                            await self._backoff(attempt, response.headers.get('Retry-After'))
+                            continue
+                        response.raise_for_status()
+                        text = await response.text()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if attempt < self.max_retries and not isinstance(e, aiohttp.ClientResponseError):
+                        await self._backoff(attempt)
+                        continue
+                    logging.error(f"Request failed: {e}")
+                    return False, None
+
+                # Skip empty responses
+                if not text:
+                    logging.warning("Empty JSON response, skipping.")
+                    return False, None
+                try:
+                    result = classify_response(json.loads(text))
+                except ValueError:
+                    logging.error(f"Failed to decode JSON response: {text}")
+                    return False, None
+                if result[0]:
+                    metrics.inc('hate_speech_flagged')
+                    if sample():
+                        logging.info("Hate speech detected (sampled): %s with confidence %s", comment, result[1])
+                return result
+        return False, None
+
+    async def check_all(self, comments):
+        return await asyncio.gather(*(self.check(comment) for comment in comments))
+
+
+def check_comments(comments, token, **client_options):
+    # Blocking entry point for the analysis scripts: returns [(is_hate_speech, confidence)]
+    # in input order
+    async def run():
+        async with HateSpeechClient(token, **client_options) as client:
+            return await client.check_all(comments)
+    return asyncio.run(run())
@@ -0,0 +1,48 @@
+import asyncio
+import argparse
+import random
+from aiohttp import web
+
+# Local stand-in for the ModerateHateSpeech API: same endpoint and JSON shape, with configurable
+# latency and failure rate, so the analysis stage can be exercised and benchmarked offline.
+# Texts containing one of FLAG_WORDS are flagged.
+API_PATH = '/api/v1/moderate/'
+FLAG_WORDS = ('hate', 'kill', 'scum')
+
+
+def classify(text):
+    if any(word in text for word in FLAG_WORDS):
+        return 'flag', f"{random.uniform(0.91, 0.99):.4f}"
+    return 'normal', f"{random.uniform(0.5, 0.99):.4f}"
+
+
+def make_app(latency_ms=50, jitter_ms=0, error_rate=0.0):
+    async def moderate(request):
+        data = await request.json()
+        await asyncio.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+        if random.random() < error_rate:
+            return web.json_response({"response": "Rate limited"}, status=429, headers={'Retry-After': '0'})
+        if not data.get("token"):
+            return web.json_response({"response": "Invalid token"})
+        class_value, confidence = classify(data.get("text") or '')
+        return web.json_response({"response": "Success", "class": class_value, "confidence": confidence})
+
+    app = web.Application()
+    app.router.add_post(API_PATH, moderate)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    print(f"Point MODERATE_HATE_SPEECH_API_URL at http://{args.host}:{args.port}{API_PATH}")
+    web.run_app(make_app(args.latency_ms, args.jitter_ms, args.error_rate), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
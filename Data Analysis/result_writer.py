@@ -0,0 +1,90 @@
+import io
+import os
+from psycopg2 import sql
+from analysis_db import ALL_SHARDS, save_checkpoint
+from metrics import metrics
+
+RESULT_BATCH_SIZE = int(os.getenv('RESULT_BATCH_SIZE', '5000'))
+
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value):
+    # One field in COPY's text format
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).translate(COPY_ESCAPES)
+
+
+class ResultWriter:
+    # Buffers result rows and writes each batch with COPY into a staging table, then merges it
+    # into the results table with one INSERT ... SELECT ... ON CONFLICT DO NOTHING. The staging
+    # table is a session-local temporary table (never WAL-logged, emptied on commit), so
+    # parallel workers each get their own. It only has the written columns, without defaults,
+    # so a serial id on the results table is not advanced for staged rows. Nothing is committed
+    # here: the caller commits after flush(), together with its checkpoint.
+    def __init__(self, connection, table_name, columns, conflict_columns=('comment_id',), batch_size=RESULT_BATCH_SIZE):
+        self.connection = connection
+        self.table_name = table_name
+        self.columns = columns
+        self.staging_table = f"{table_name}_staging"
+        self.batch_size = batch_size
+        self.rows = []
+        column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL("""
+                CREATE TEMPORARY TABLE IF NOT EXISTS {} ON COMMIT DELETE ROWS
+                AS SELECT {} FROM {} WITH NO DATA
+            """).format(sql.Identifier(self.staging_table), column_list, sql.Identifier(table_name)))
+            self.copy_query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+                sql.Identifier(self.staging_table), column_list
+            ).as_string(cursor)
+        self.merge_query = sql.SQL("""
+            INSERT INTO {target} ({columns}) SELECT {columns} FROM {staging}
+            ON CONFLICT ({conflict}) DO NOTHING
+        """).format(
+            target=sql.Identifier(table_name),
+            columns=column_list,
+            staging=sql.Identifier(self.staging_table),
+            conflict=sql.SQL(', ').join(map(sql.Identifier, conflict_columns))
+        )
+        self.delete_query = sql.SQL("DELETE FROM {}").format(sql.Identifier(self.staging_table))
+
+    def add(self, row):
+        self.rows.append(row)
+
+    def full(self):
+        return len(self.rows) >= self.batch_size
+
+    def flush(self):
+        # Returns the number of rows that were new to the results table
+        if not self.rows:
+            return 0
+        buffer = io.StringIO()
+        for row in self.rows:
+            buffer.write('\t'.join(map(copy_value, row)))
+            buffer.write('\n')
+        buffer.seek(0)
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert(self.copy_query, buffer)
+            cursor.execute(self.merge_query)
+            inserted = cursor.rowcount
+            # Also emptied on commit; cleared now so a second flush in the same transaction
+            # does not merge these rows again
+            cursor.execute(self.delete_query)
+        self.rows = []
+        return inserted
+
+
+def commit_batch(connection, writer, source_table, target_table, last_id, shard=ALL_SHARDS):
+    # Merges the buffered results and moves the checkpoint in one transaction, so a crash
+    # neither skips nor duplicates comments
+    with metrics.timer('write'):
+        inserted = writer.flush()
+        with connection.cursor() as cursor:
+            save_checkpoint(cursor, source_table, target_table, last_id, shard)
+        connection.commit()
+    metrics.add_rows('write', inserted)
+    return inserted
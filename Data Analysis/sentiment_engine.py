@@ -0,0 +1,83 @@
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor
+from nltk.sentiment import SentimentIntensityAnalyzer
+
+SENTIMENT_WORKERS = int(os.getenv('SENTIMENT_WORKERS', str(os.cpu_count() or 1)))
+SENTIMENT_BATCH_SIZE = int(os.getenv('SENTIMENT_BATCH_SIZE', '500'))
+# Below this a batch is not worth the round trip to another process
+MIN_BATCH_SIZE = 50
+
+# Same cut-offs analyze_sentiment has always used
+POSITIVE_THRESHOLD = 0.05
+NEGATIVE_THRESHOLD = -0.05
+
+# One analyzer per process: loading the VADER lexicon is far more expensive than scoring
+_analyzer = None
+
+
+def _load_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
+
+
+def sentiment_label(compound):
+    if compound >= POSITIVE_THRESHOLD:
+        return 'positive'
+    if compound <= NEGATIVE_THRESHOLD:
+        return 'negative'
+    return 'neutral'
+
+
+def score_batch(comments):
+    # Returns (labels, compound scores) in input order; non-string values (e.g. NaN from a
+    # NULL text column) get 'not a string' and no score, as before
+    analyzer = _load_analyzer()
+    labels = []
+    scores = []
+    for comment in comments:
+        if isinstance(comment, str):
+            compound = analyzer.polarity_scores(comment)['compound']
+            labels.append(sentiment_label(compound))
+            scores.append(compound)
+        else:
+            labels.append('not a string')
+            scores.append(None)
+    return labels, scores
+
+
+class SentimentEngine:
+    def __init__(self, workers=SENTIMENT_WORKERS, batch_size=SENTIMENT_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        # With a single worker there is nothing to gain from shipping batches to another process
+        self.executor = ProcessPoolExecutor(workers, initializer=_load_analyzer) if workers > 1 else None
+
+    def score(self, comments):
+        comments = list(comments)
+        # A chunk is split across all workers (at most batch_size comments per batch), so every
+        # process is busy however small the chunk is after cache hits
+        size = max(MIN_BATCH_SIZE, min(self.batch_size, math.ceil(len(comments) / self.workers)))
+        batches = [comments[i:i + size] for i in range(0, len(comments), size)]
+        if self.executor is None or len(batches) < 2:
+            results = map(score_batch, batches)
+        else:
+            results = self.executor.map(score_batch, batches)
+        labels = []
+        scores = []
+        for batch_labels, batch_scores in results:
+            labels.extend(batch_labels)
+            scores.extend(batch_scores)
+        return labels, scores
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
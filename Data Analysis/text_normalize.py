@@ -0,0 +1,166 @@
+import os
+import re
+import math
+from collections import Counter
+
+# Cleaning shared by every analysis script. A single precompiled pass gives the same output as
+# the old two-step clean_comment (drop http(s) links, then everything except ASCII letters,
+# digits and whitespace, then lowercase): a link always starts with an ASCII letter, so the
+# second alternative can never eat into one.
+CLEAN_RE = re.compile(r'https?://\S+|[^a-zA-Z0-9\s]+')
+
+
+def clean_comment(comment):
+    return CLEAN_RE.sub('', comment).lower()
+
+
+def clean_comments(comments):
+    # NULL texts come through as None (or NaN); they clean to an empty string
+    sub = CLEAN_RE.sub
+    return [sub('', comment).lower() if isinstance(comment, str) else '' for comment in comments]
+
+
+# Languages we score. Every comment is tagged with its most likely language, but one is only
+# skipped before VADER and the hate-speech API when the call is confident: a skipped comment is
+# never analyzed again, while scoring a foreign one only costs a little time. Short Latin-script
+# text ('kek nice digits') is too easily mistaken for another language, so it is always scored,
+# and so is 'und' (too short or too ambiguous to tag at all).
+TARGET_LANGUAGES = set(os.getenv('TARGET_LANGUAGES', 'en').split(','))
+UNDETERMINED = 'und'
+MIN_LETTERS = 12
+MIN_MARGIN = 0.02
+SKIP_MIN_LETTERS = 40
+SKIP_MARGIN = 0.3
+
+# Non-Latin scripts are identified from code point ranges on the raw text, before cleaning
+# strips them. A text is tagged with a script once more than half its letters belong to it.
+SCRIPT_RANGES = (
+    ('ru', ((0x0400, 0x052F),)),
+    ('el', ((0x0370, 0x03FF),)),
+    ('he', ((0x0590, 0x05FF),)),
+    ('ar', ((0x0600, 0x06FF), (0x0750, 0x077F))),
+    ('hi', ((0x0900, 0x097F),)),
+    ('th', ((0x0E00, 0x0E7F),)),
+    ('ko', ((0xAC00, 0xD7AF), (0x1100, 0x11FF))),
+    ('ja', ((0x3040, 0x30FF),)),
+    ('zh', ((0x4E00, 0x9FFF), (0x3400, 0x4DBF))),
+)
+SCRIPT_OF = {}
+for _language, _ranges in SCRIPT_RANGES:
+    for _start, _end in _ranges:
+        for _code in range(_start, _end + 1):
+            SCRIPT_OF[chr(_code)] = _language
+
+# Small embedded reference texts; character trigram frequencies from these are enough to tell
+# the common Latin-script languages apart on comment-length input.
+SAMPLES = {
+    'en': """the economy is going into a recession and nobody in this thread wants to admit it.
+        prices keep going up while wages stay the same, and the people who were told to wait it out
+        are still waiting. i think the government should have acted sooner but they never listen.
+        what do you think will happen with the election this year? honestly it does not matter who
+        wins because both of them have the same donors. that is just how it works now, sadly.
+        my friend lost his job last month and he has been looking for work ever since.""",
+    'es': """la economía está entrando en recesión y nadie en este hilo quiere admitirlo.
+        los precios siguen subiendo mientras los salarios se quedan igual, y la gente que fue
+        aconsejada a esperar todavía está esperando. creo que el gobierno debería haber actuado
+        antes pero nunca escuchan. ¿qué piensas que pasará con las elecciones este año? la verdad
+        no importa quién gane porque los dos tienen los mismos donantes. así funciona ahora.
+        mi amigo perdió su trabajo el mes pasado y desde entonces está buscando empleo.""",
+    'fr': """l'économie entre en récession et personne dans ce fil ne veut l'admettre.
+        les prix continuent de monter alors que les salaires restent les mêmes, et les gens à qui
+        on a dit d'attendre attendent toujours. je pense que le gouvernement aurait dû agir plus tôt
+        mais ils n'écoutent jamais. qu'est-ce que tu penses qu'il va se passer avec l'élection cette
+        année? honnêtement peu importe qui gagne parce que les deux ont les mêmes donateurs.
+        mon ami a perdu son travail le mois dernier et il cherche un emploi depuis.""",
+    'de': """die wirtschaft rutscht in eine rezession und niemand in diesem thread will es zugeben.
+        die preise steigen weiter während die löhne gleich bleiben, und die leute, denen man gesagt
+        hat, sie sollen abwarten, warten immer noch. ich glaube die regierung hätte früher handeln
+        sollen, aber sie hören nie zu. was glaubst du, wie die wahl dieses jahr ausgeht? ehrlich
+        gesagt ist es egal wer gewinnt, weil beide dieselben spender haben. so läuft das jetzt.
+        mein freund hat letzten monat seine arbeit verloren und sucht seitdem eine neue stelle.""",
+    'pt': """a economia está entrando em recessão e ninguém neste tópico quer admitir isso.
+        os preços continuam subindo enquanto os salários ficam iguais, e as pessoas que ouviram
+        para esperar ainda estão esperando. eu acho que o governo deveria ter agido antes mas eles
+        nunca escutam. o que você acha que vai acontecer com a eleição deste ano? sinceramente não
+        importa quem ganhe porque os dois têm os mesmos doadores. é assim que funciona agora.
+        meu amigo perdeu o emprego no mês passado e desde então está procurando trabalho.""",
+    'it': """l'economia sta entrando in recessione e nessuno in questo thread vuole ammetterlo.
+        i prezzi continuano a salire mentre gli stipendi restano uguali, e le persone a cui è stato
+        detto di aspettare stanno ancora aspettando. penso che il governo avrebbe dovuto agire prima
+        ma non ascoltano mai. cosa pensi che succederà con le elezioni di quest'anno? onestamente
+        non importa chi vince perché entrambi hanno gli stessi donatori. ormai funziona così.
+        il mio amico ha perso il lavoro il mese scorso e da allora sta cercando un impiego.""",
+    'nl': """de economie glijdt af naar een recessie en niemand in deze draad wil het toegeven.
+        de prijzen blijven stijgen terwijl de lonen hetzelfde blijven, en de mensen die werd verteld
+        om af te wachten wachten nog steeds. ik denk dat de regering eerder had moeten ingrijpen
+        maar ze luisteren nooit. wat denk jij dat er met de verkiezingen van dit jaar gebeurt?
+        eerlijk gezegd maakt het niet uit wie er wint want ze hebben allebei dezelfde donateurs.
+        mijn vriend is vorige maand zijn baan kwijtgeraakt en zoekt sindsdien naar werk.""",
+}
+
+LINK_RE = re.compile(r'https?://\S+|www\.\S+')
+NON_LETTER_RE = re.compile(r"[\W\d_]+")
+
+
+def _trigrams(text):
+    words = NON_LETTER_RE.sub(' ', LINK_RE.sub(' ', text.lower())).split()
+    padded = ' ' + ' '.join(words) + ' '
+    return [padded[i:i + 3] for i in range(len(padded) - 2)], sum(map(len, words))
+
+
+def _build_profiles(samples):
+    # Log-probabilities with add-one smoothing over the trigrams seen in any sample, stored as
+    # one tuple per trigram (a value per language, in LANGUAGES order) so that scoring a text
+    # costs one dict lookup per trigram rather than one per trigram and language
+    counts = {language: Counter(_trigrams(sample)[0]) for language, sample in samples.items()}
+    vocabulary = len(set().union(*counts.values()))
+    totals = {language: sum(counter.values()) + vocabulary for language, counter in counts.items()}
+    unseen = tuple(math.log(1 / totals[language]) for language in samples)
+    weights = {trigram: tuple(math.log((counts[language][trigram] + 1) / totals[language]) for language in samples)
+               for trigram in set().union(*counts.values())}
+    return weights, unseen
+
+
+LANGUAGES = tuple(SAMPLES)
+PROFILE_WEIGHTS, PROFILE_UNSEEN = _build_profiles(SAMPLES)
+
+
+def identify_language(text):
+    # (language, confident); confident means sure enough to skip the comment if it is not a
+    # target language
+    if not isinstance(text, str):
+        return UNDETERMINED, False
+    scripts = Counter(SCRIPT_OF[char] for char in text if char in SCRIPT_OF)
+    if scripts:
+        language, count = scripts.most_common(1)[0]
+        letters = sum(1 for char in text if char.isalpha())
+        if count * 2 > letters:
+            return language, True
+    trigrams, letters = _trigrams(text)
+    if letters < MIN_LETTERS:
+        return UNDETERMINED, False
+    get = PROFILE_WEIGHTS.get
+    totals = [sum(column) / len(trigrams) for column in zip(*(get(trigram, PROFILE_UNSEEN) for trigram in trigrams))]
+    scores = sorted(zip(totals, LANGUAGES), reverse=True)
+    if scores[0][0] - scores[1][0] < MIN_MARGIN:
+        return UNDETERMINED, False
+    best_score, language = scores[0]
+    # Compared with the best scoring target language, or the runner-up if no target has a profile
+    target_scores = [score for score, candidate in scores if candidate in TARGET_LANGUAGES]
+    rival = target_scores[0] if target_scores else scores[1][0]
+    return language, letters >= SKIP_MIN_LETTERS and best_score - rival >= SKIP_MARGIN
+
+
+def is_target_language(language):
+    return language == UNDETERMINED or language in TARGET_LANGUAGES
+
+
+def identify_languages(texts):
+    # (languages, scored): the tag for each text, and whether it should be scored
+    languages = []
+    scored = []
+    for text in texts:
+        language, confident = identify_language(text)
+        languages.append(language)
+        scored.append(not confident or is_target_language(language))
+    return languages, scored
@@ -0,0 +1,125 @@
+import re
+import sys
+import time
+import random
+from text_normalize import clean_comments, identify_languages
+
+REPEAT = 20000
+SEED = 7
+PIECES = ['Hello', 'WORLD', 'http://example.com/a?b=1', 'https://t.co/xyz)', '(see https://x.io)', '!!!', '>>123456',
+          'café', 'naïve', '日本語', 'Привет', '😂', ' ', '\t', '\n', "don't", 'hthttp://x', 'HTTP://UPPER',
+          '&amp;', '<br>', '42', 'lol', 'recession', '¿qué?', '']
+
+# Labelled comment-style texts for measuring language id. None of them appear in (or were
+# derived from) the reference samples in text_normalize, which the trigram profiles are built on.
+HELD_OUT = [
+    ('en', "did anyone else get the update last night? my phone keeps restarting every hour"),
+    ('en', "this is the worst take i have read all week, go touch some grass lmao"),
+    ('en', "Can confirm, the store near me raised the price of eggs again. Absolutely ridiculous."),
+    ('en', "Source? Because every article I found says the exact opposite of what you claim."),
+    ('en', "I used to love this show but the last two seasons were a complete mess"),
+    ('en', "Thanks for posting this, I had no idea the bridge was closed until Friday"),
+    # Short and slangy English, the kind most easily mistaken for another language
+    ('en', "first comment!! love ur vids"),
+    ('en', "inflation is at 3 percent now"),
+    ('en', "kek nice digits"),
+    ('en', "ratio + L + didnt ask"),
+    ('en', "sauce pls"),
+    ('en', "cope seethe dilate"),
+    ('en', "literally unwatchable"),
+    ('en', "mods are asleep post lemons"),
+    ('en', "ngl this slaps fr fr"),
+    ('en', "this aged like milk"),
+    ('en', "nice try fed"),
+    ('en', "based and redpilled"),
+    ('en', "who else is watching in 2025"),
+    ('en', "the absolute state of this board"),
+    ('en', "bro really said that lmao"),
+    ('en', "spoiler: the butler did it and everyone knew by episode two"),
+    ('es', "alguien sabe a qué hora empieza el partido mañana? no encuentro el horario"),
+    ('es', "Qué vergüenza lo que hizo el alcalde, deberían pedirle la renuncia ya mismo"),
+    ('es', "Me encanta esta canción, la escucho todos los días camino al trabajo"),
+    ('es', "No entiendo por qué la gente sigue comprando esos teléfonos tan caros"),
+    ('es', "Llevo tres semanas esperando el paquete y la empresa no contesta los correos"),
+    ('fr', "quelqu'un sait pourquoi le métro est en panne ce matin? je vais être en retard"),
+    ('fr', "C'est vraiment n'importe quoi, ils ont encore augmenté le prix de l'essence"),
+    ('fr', "J'adore cette chaîne, les vidéos sont toujours bien expliquées et drôles"),
+    ('fr', "Franchement je ne comprends pas pourquoi tout le monde parle de ce film"),
+    ('fr', "Mes voisins font des travaux depuis six heures du matin, je n'en peux plus"),
+    ('de', "weiß jemand, warum die bahn heute schon wieder ausfällt? das ist doch lächerlich"),
+    ('de', "Ich finde das Video richtig gut, endlich erklärt es mal jemand verständlich"),
+    ('de', "Die Mieten in meiner Stadt sind in den letzten zwei Jahren komplett explodiert"),
+    ('de', "Hat hier schon jemand das neue Handy gekauft und kann etwas dazu sagen?"),
+    ('de', "Unser Hund bellt jedes Mal, wenn der Postbote an der Tür klingelt"),
+    ('pt', "alguém sabe se o jogo de amanhã vai passar na televisão aberta?"),
+    ('pt', "Que absurdo, o preço da gasolina subiu de novo e ninguém faz nada"),
+    ('pt', "Adoro esse canal, os vídeos são sempre muito bem feitos e engraçados"),
+    ('pt', "Não consigo entender por que as pessoas ainda acreditam nessas notícias falsas"),
+    ('pt', "Minha vizinha faz bolo todo domingo e o cheiro invade o prédio inteiro"),
+    ('it', "qualcuno sa perché il treno per Milano è sempre in ritardo la mattina?"),
+    ('it', "Che vergogna, hanno alzato di nuovo le tasse e nessuno dice niente"),
+    ('it', "Adoro questo canale, i video sono sempre fatti benissimo e divertenti"),
+    ('it', "Non capisco perché la gente continua a comprare quei telefoni così costosi"),
+    ('it', "Mia nonna fa la pasta fresca ogni domenica e tutta la famiglia viene a pranzo"),
+    ('nl', "weet iemand waarom de trein naar Utrecht vandaag weer is uitgevallen?"),
+    ('nl', "Wat een schande, de huurprijzen in deze stad zijn echt niet meer te betalen"),
+    ('nl', "Ik vind dit kanaal geweldig, de video's zijn altijd goed uitgelegd"),
+    ('nl', "Ik snap niet waarom mensen nog steeds die dure telefoons blijven kopen"),
+    ('nl', "Onze kat slaapt de hele dag en rent 's nachts door het hele huis"),
+]
+
+
+def reference_clean_comment(comment):
+    # The two-step clean_comment the analysis scripts used before text_normalize
+    comment_without_links = re.sub(r'https?://\S+', '', comment)
+    return re.sub(r'[^a-zA-Z0-9\s]', '', comment_without_links).lower()
+
+
+def make_corpus(size):
+    rng = random.Random(SEED)
+    separators = [' ', '', '  ', '\n']
+    return [''.join(rng.choice(PIECES) + rng.choice(separators) for _ in range(rng.randint(1, 30)))
+            for _ in range(size)]
+
+
+def timed(function, texts):
+    start = time.perf_counter()
+    function(texts)
+    return time.perf_counter() - start
+
+
+def main():
+    texts = make_corpus(REPEAT)
+    expected = [reference_clean_comment(text) for text in texts]
+    actual = clean_comments(texts)
+    mismatches = [(text, e, a) for text, e, a in zip(texts, expected, actual) if e != a]
+    for text, e, a in mismatches[:10]:
+        print(f"MISMATCH {text!r}\n  expected {e!r}\n  actual   {a!r}")
+    if mismatches:
+        sys.exit(1)
+    print(f"Parity OK on {len(texts)} comments")
+
+    reference = timed(lambda batch: [reference_clean_comment(text) for text in batch], texts)
+    fast = timed(clean_comments, texts)
+    print(f"clean (per call re.sub): {len(texts) / reference:,.0f} comments/s")
+    print(f"clean_comments:          {len(texts) / fast:,.0f} comments/s ({reference / fast:.1f}x)")
+
+    # Language identification on held-out comments: how often the stored tag is right, and
+    # which comments would be skipped. A skipped English comment is lost for good, so that
+    # count has to stay at zero; foreign comments that are still scored only cost time.
+    detected, scored = identify_languages([text for _, text in HELD_OUT])
+    correct = sum(1 for (language, _), guess in zip(HELD_OUT, detected) if language == guess)
+    undetermined = detected.count('und')
+    for (language, text), guess in zip(HELD_OUT, detected):
+        if guess not in (language, 'und'):
+            print(f"  {language} -> {guess}: {text!r}")
+    english = [flag for (language, _), flag in zip(HELD_OUT, scored) if language == 'en']
+    foreign = [flag for (language, _), flag in zip(HELD_OUT, scored) if language != 'en']
+    print(f"Language id: {correct}/{len(HELD_OUT)} held-out comments tagged correctly, {undetermined} undetermined")
+    print(f"Skipped: {english.count(False)}/{len(english)} English, {foreign.count(False)}/{len(foreign)} other languages")
+    elapsed = timed(identify_languages, texts)
+    print(f"identify_languages:      {len(texts) / elapsed:,.0f} comments/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,19 @@ import pandas as pd
 import psycopg2
 import time
 import datetime
+import queue
+import threading
 import logging
 import schedule
+from concurrent.futures import ThreadPoolExecutor, wait
 from Data_config import REDDIT_API_CONFIG, DB_CONFIG, TARGET_TABLE
+from db import BATCH_SIZE, ensure_column, ensure_unique_index, insert_ignore_conflicts
+from ratelimit import TokenBucket
+from http_client import OAuthToken, get_session
+from records import Comment, RedditComment
+from comments_store import ensure_comments_table, load_comments
+from metrics import metrics
+from run_mode import ONCE, budget, finish, since_cutoff
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 client_id = REDDIT_API_CONFIG['client_id']
@@ -22,122 +32,231 @@ subreddits_df = pd.read_csv('/home/hkatakam/dbtest/subreddits.csv')
 subreddits = subreddits_df['subreddit'].tolist()
 MAX_REQUESTS_PER_MINUTE = 100
 RATE_LIMIT_RESET_SECONDS = 60
-headers = {'User-Agent': 'myproj/0.0.1'}
+MAX_WORKERS = 8
+POLL_INTERVAL_SECONDS = 1
+PAGE_LIMIT = 100
+MAX_PAGES_PER_POLL = 10
+PAGE_QUEUE_SIZE = MAX_WORKERS * 2
+QUEUE_PUT_TIMEOUT_SECONDS = 1
+COMMENT_COLUMNS = ('subreddit', 'post_id', 'body', 'score', 'created_utc', 'comment_id', 'created_at')
+WATERMARK_TABLE = f"{TARGET_TABLE}_watermarks"
+rate_limiter = TokenBucket(MAX_REQUESTS_PER_MINUTE, RATE_LIMIT_RESET_SECONDS)
+session = get_session('oauth.reddit.com', pool_maxsize=MAX_WORKERS)
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
-def fetch_comments_for_subreddit(subreddit):
-    global data
+def put_page(pages, message, stop):
+    # Gives up once the consumer has stopped reading, instead of blocking the worker forever
+    while not stop.is_set():
+        try:
+            pages.put(message, timeout=QUEUE_PUT_TIMEOUT_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def fetch_comments_for_subreddit(subreddit, pages, stop):
+    # Streams each page of new comments onto the queue, then a final (subreddit, None, newest) marker
     logging.info(f"Fetching comments for subreddit: {subreddit}")
-    data = pd.DataFrame()
-    after = None
-    current_time = time.time()
-    requests_made = 0
-    last_request_time = time.time()
-    for i in range(1):
-        logging.info(f"Fetching comments for day ")
-        if requests_made >= MAX_REQUESTS_PER_MINUTE:
-            elapsed_time = time.time() - last_request_time
-            if elapsed_time < RATE_LIMIT_RESET_SECONDS:
-                sleep_time = RATE_LIMIT_RESET_SECONDS - elapsed_time
-                logging.info(f"Rate limit reached. Sleeping for {sleep_time} seconds.")
-                time.sleep(sleep_time)
-            requests_made = 0
-            last_request_time = time.time()
-        
-        start_of_day = datetime.datetime.utcfromtimestamp(current_time - (i + 1) * 86400).strftime('%Y-%m-%d')
-        end_of_day = datetime.datetime.utcfromtimestamp(current_time - i * 86400).strftime('%Y-%m-%d')      
-        url = f"https://oauth.reddit.com/r/{subreddit}/comments?sort=new&time_filter=all&before={end_of_day}&after={start_of_day}"
-        logging.debug(f"Fetching comments from {url}")
-        res = requests.get(url, headers=headers)
-        rate_limit_used = int(float(res.headers.get('X-Ratelimit-Used', 0)))
-        rate_limit_remaining = int(float(res.headers.get('X-Ratelimit-Remaining', 0)))
-        rate_limit_reset = int(float(res.headers.get('X-Ratelimit-Reset', 0)))
-        requests_made += rate_limit_used
-        last_request_time = time.time()
-        if rate_limit_remaining <= 0:
-            sleep_time = max(1, rate_limit_reset)  
-            logging.info(f"Rate limit exceeded. Sleeping for {sleep_time} seconds.")
-            time.sleep(sleep_time)
+    newest = None
+    complete = False
+    watermark = watermarks.get(subreddit)
+    # A one-shot run pages back to the start of its SINCE_HOURS window
+    window_start = since_cutoff().timestamp() if ONCE else None
+    try:
+        after = None
+        max_pages = MAX_PAGES_PER_POLL if watermark or ONCE else 1
+        for _ in range(max_pages):
+            if stop.is_set():
+                break
+            if budget.expired():
+                logging.warning(f"Run budget exhausted while fetching subreddit {subreddit}.")
+                break
+            url = f"https://oauth.reddit.com/r/{subreddit}/comments?sort=new&limit={PAGE_LIMIT}"
+            if after:
+                url += f"&after={after}"
+            logging.debug(f"Fetching comments from {url}")
+            res = reddit_get(url)
+            try:
+                comments, after = comments_from_response(res)
+            except Exception as e:
+                logging.error(f"Error processing response: {e}")
+                break
+            if not comments:
+                complete = True
+                break
+            reached_end = False
+            if watermark:
+                last_comment_id, last_created_utc = watermark
+                new_comments = [
+                    comment for comment in comments
+                    if comment.comment_id != last_comment_id and comment.created_utc >= last_created_utc
+                ]
+                reached_end = len(new_comments) < len(comments)
+                comments = new_comments
+            if window_start is not None:
+                in_window = [comment for comment in comments if comment.created_utc >= window_start]
+                reached_end = reached_end or len(in_window) < len(comments)
+                comments = in_window
+            if comments:
+                page_newest = max(comments, key=lambda comment: comment.created_utc)
+                if newest is None or page_newest.created_utc > newest.created_utc:
+                    newest = page_newest
+                if not put_page(pages, (subreddit, comments, None), stop):
+                    break
+            if reached_end or not after:
+                complete = True
+                break
+        else:
+            if watermark:
+                logging.warning(f"Hit {max_pages} pages for subreddit {subreddit} before reaching the stored watermark.")
+    finally:
+        # Pages run newest first, so moving the watermark after stopping early would skip the
+        # comments between the last page fetched and the old watermark for good. It only moves
+        # once paging got back to the watermark, the window start or the end of the listing;
+        # otherwise the next poll pages back to the old one. The very first poll of a subreddit
+        # fetches one page and sets the initial watermark from it.
+        if not complete and (watermark or window_start is not None):
+            if newest is not None:
+                logging.warning(f"Keeping the previous watermark for subreddit {subreddit}; paging stopped early.")
+            newest = None
+        put_page(pages, (subreddit, None, newest), stop)
+
+def reddit_get(url):
+    rate_limiter.acquire()
+    res = timed_get(url)
+    if res.status_code == 401:
+        # Token revoked or expired early; refresh once and retry
+        reddit_token.invalidate()
+        rate_limiter.acquire()
+        res = timed_get(url)
+    rate_limiter.update_from_headers(res.headers)
+    return res
+
+def timed_get(url):
+    start = time.perf_counter()
+    with metrics.timer('fetch'):
+        res = session.get(url, headers=reddit_token.headers())
+    metrics.observe('reddit', time.perf_counter() - start)
+    metrics.inc(f"reddit_http_{res.status_code}")
+    return res
+
+def iter_pages(pages, total):
+    finished = 0
+    while finished < total:
+        message = pages.get()
+        if message[1] is None:
+            finished += 1
+        yield message
+
+def run_cycle():
+    # Fetch every subreddit concurrently through a bounded queue; the database is only
+    # touched from this thread and at most PAGE_QUEUE_SIZE pages are held in memory
+    pages = queue.Queue(maxsize=PAGE_QUEUE_SIZE)
+    stop = threading.Event()
+    futures = [executor.submit(fetch_comments_for_subreddit, subreddit, pages, stop) for subreddit in subreddits]
+    inserted = {}
+    try:
+        for subreddit, comments, newest in iter_pages(pages, len(futures)):
+            if comments is not None:
+                inserted[subreddit] = inserted.get(subreddit, 0) + insert_comments_bulk(comments)
+                connection.commit()
+            elif newest is not None:
+                save_watermark(subreddit, newest.comment_id, newest.created_utc)
+                connection.commit()
+                logging.info(f"Inserted {inserted.get(subreddit, 0)} comments into the database for subreddit {subreddit}.")
+            else:
+                logging.info(f"No comments to insert into PostgreSQL for subreddit: {subreddit}")
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        # If writing failed nobody reads the queue any more: stop the fetchers and wait for them,
+        # otherwise they block on a full queue and the executor keeps the process from exiting
+        stop.set()
+        for future in futures:
+            future.cancel()
+        wait(futures)
+    for future in futures:
+        if future.exception() is not None:
+            logging.error(f"Error fetching comments: {future.exception()}")
+    metrics.write()
+    return inserted
+
+def load_watermarks():
+    cursor.execute(f"SELECT subreddit, last_comment_id, last_created_utc FROM {WATERMARK_TABLE}")
+    return {subreddit: (comment_id, created_utc) for subreddit, comment_id, created_utc in cursor.fetchall()}
+
+def save_watermark(subreddit, comment_id, created_utc):
+    cursor.execute(f"""
+    INSERT INTO {WATERMARK_TABLE} (subreddit, last_comment_id, last_created_utc)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (subreddit) DO UPDATE
+    SET last_comment_id = EXCLUDED.last_comment_id, last_created_utc = EXCLUDED.last_created_utc
+    WHERE EXCLUDED.last_created_utc >= {WATERMARK_TABLE}.last_created_utc
+    """, (subreddit, comment_id, created_utc))
+    current = watermarks.get(subreddit)
+    if current is None or created_utc >= current[1]:
+        watermarks[subreddit] = (comment_id, created_utc)
+
+def insert_comments_bulk(comments):
+    rows = []
+    unified = []
+    for comment in comments:
+        created_at = datetime.datetime.fromtimestamp(comment.created_utc, datetime.timezone.utc)
+        rows.append((comment.subreddit, comment.post_id, comment.body, comment.score,
+                     datetime.datetime.utcfromtimestamp(comment.created_utc), comment.comment_id, created_at))
+        unified.append(Comment('reddit', comment.subreddit, comment.author, comment.comment_id, created_at, comment.body))
+    with metrics.timer('write'):
+        inserted = insert_ignore_conflicts(cursor, TARGET_TABLE, COMMENT_COLUMNS, rows, ('comment_id',), page_size=BATCH_SIZE)
+        load_comments(cursor, unified)
+    metrics.add_rows('write', inserted)
+    return inserted
+
+def iter_comments(json_data):
+    for comment in json_data['data'].get('children', []):
         try:
-            comment_data = df_from_response(res)
-        except Exception as e:
-            logging.error(f"Error processing response: {e}")
-            continue
-        if comment_data.empty:
-            logging.info(f"No comments to insert into PostgreSQL for subreddit: {subreddit}")
-            break
-        comment_df = comment_data
-        data = pd.concat([data, comment_df], ignore_index=True)
-        row = comment_df.iloc[-1]
-        after = row['id']
-    comment_df_dict = data.to_dict("records")
-    if comment_df_dict:
-        for comment in comment_df_dict:
-            check_query = f"SELECT EXISTS(SELECT 1 FROM {TARGET_TABLE} WHERE comment_id = %s)"
-            cursor.execute(check_query, (comment['id'],))
-            comment_exists = cursor.fetchone()[0]
-            if comment_exists:
-                logging.info(f"Comment with ID {comment['id']} already exists in the database. Skipping.")
-                continue  
-            created_utc = datetime.datetime.utcfromtimestamp(comment['created_utc'])
-            insert_query = f"""
-            INSERT INTO {TARGET_TABLE} (subreddit, post_id, body, score, created_utc, comment_id)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(insert_query, (
-                comment['subreddit'],
-                comment['post_id'],
-                comment['body'],
-                comment['score'],
-                created_utc,  
-                comment['id']
-            ))
-            rows_inserted = cursor.rowcount
-            logging.info(f"Inserted {rows_inserted} row(s) for comment with ID {comment['id']}.")
-        connection.commit()
-        logging.info(f"Inserted {len(comment_df_dict)} comments into the database for subreddit {subreddit}.")
-    else:
-        logging.info(f"No comments to insert into PostgreSQL for subreddit: {subreddit}")
-
-def df_from_response(res):
-    comment_data = []
+            comment_data = comment['data']
+            yield RedditComment(
+                comment_data['subreddit'],
+                comment_data['link_id'],
+                comment_data['body'],
+                comment_data.get('score', 0),
+                comment_data['created_utc'],
+                comment_data['id'],
+                comment_data.get('author')
+            )
+        except KeyError as e:
+            logging.error(f"KeyError while extracting comment data: {e}")
+
+def comments_from_response(res):
     try:
         json_data = res.json()
     except ValueError as e:
         logging.error(f"Failed to parse JSON response: {e}")
-        return pd.DataFrame()
-    if 'data' in json_data:
-        for comment in json_data['data'].get('children', []):
-            try:
-                comment_dict = {
-                    'subreddit': comment['data']['subreddit'],
-                    'post_id': comment['data']['link_id'],
-                    'body': comment['data']['body'],
-                    'score': comment['data'].get('score', 0),
-                    'created_utc': comment['data']['created_utc'],
-                    'id': comment['data']['id']
-                }
-                comment_data.append(comment_dict)
-            except KeyError as e:
-                logging.error(f"KeyError while extracting comment data: {e}")
-    comment_df = pd.DataFrame(comment_data)
-    return comment_df
-
-# Authentication with Reddit API
-client_auth = requests.auth.HTTPBasicAuth(client_id, client_secret)
-data = {
-    'grant_type': 'password',
-    'username': username,
-    'password': password
-}
-headers = {'User-Agent': 'myproj/0.0.1'}
-response = requests.post('https://www.reddit.com/api/v1/access_token', auth=client_auth, data=data, headers=headers)
-
-if response.status_code == 200:
-    access_token = response.json()['access_token']
-    headers['Authorization'] = f'Bearer {access_token}'
+        return [], None
+    if 'data' not in json_data:
+        return [], None
+    with metrics.timer('parse'):
+        comments = list(iter_comments(json_data))
+    metrics.add_rows('parse', len(comments))
+    return comments, json_data['data'].get('after')
+
+# Authentication with Reddit API; the token is refreshed automatically before it expires
+reddit_token = OAuthToken(
+    'https://www.reddit.com/api/v1/access_token',
+    client_id,
+    client_secret,
+    {
+        'grant_type': 'password',
+        'username': username,
+        'password': password
+    }
+)
+try:
+    reddit_token.headers()
     logging.info("Successfully authenticated with Reddit API.")
-else:
-    logging.error(f"Authentication failed. Status code: {response.status_code}")
+except requests.exceptions.RequestException as e:
+    logging.error(f"Authentication failed: {e}")
 
 # Connection to PostgreSQL
 connection = psycopg2.connect(
@@ -160,12 +279,25 @@ CREATE TABLE IF NOT EXISTS {TARGET_TABLE} (
 );
 """
 cursor.execute(create_table_query)
+ensure_unique_index(cursor, TARGET_TABLE, ('comment_id',))
+ensure_column(cursor, TARGET_TABLE, 'created_at', 'timestamptz')
+ensure_comments_table(cursor)
+cursor.execute(f"""
+CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+    subreddit text PRIMARY KEY,
+    last_comment_id text,
+    last_created_utc double precision
+);
+""")
 connection.commit()
+watermarks = load_watermarks()
+
+if ONCE:
+    finish('reddit', run_cycle())
 
-# Schedule data fetching for each subreddit
-for subreddit in subreddits:
-    schedule.every(1).seconds.do(fetch_comments_for_subreddit, subreddit=subreddit)
-    logging.info(f"Scheduled data fetching for subreddit: {subreddit}")
+# Schedule one concurrent fetch cycle across all subreddits
+schedule.every(POLL_INTERVAL_SECONDS).seconds.do(run_cycle)
+logging.info(f"Scheduled data fetching for {len(subreddits)} subreddits with {MAX_WORKERS} workers")
 
 # Run the schedule
 while True:
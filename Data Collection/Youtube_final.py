@@ -1,92 +1,200 @@
-import requests
-from datetime import datetime, timedelta
+import http_client
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import csv
-import psycopg2
+import os
 import schedule
 import time
+from concurrent.futures import ThreadPoolExecutor
 from Data_config import API_KEYS, DB_CONFIG
-CACHE = {}
-current_key_index = 0
+from key_pool import KeyPool, QuotaExhausted, QUOTA_COSTS
+from disk_cache import DiskCache
+from db import BATCH_SIZE, create_pool, ensure_column, ensure_unique_index, insert_ignore_conflicts, pooled_connection
+from records import Comment, YoutubeComment
+from comments_store import ensure_comments_table, load_comments
+from metrics import metrics
+from run_mode import ONCE, SINCE_HOURS, budget, finish
+CACHE = DiskCache(os.environ.get('YOUTUBE_CACHE_PATH', 'youtube_cache.sqlite3'),
+                  max_entries=int(os.environ.get('YOUTUBE_CACHE_MAX_ENTRIES', 50000)))
+SEARCH_TTL_SECONDS = 6 * 3600
+# Short enough to revalidate every hourly run, long enough that a video returned for several
+# keywords in the same run is only fetched once
+VIDEO_STATE_TTL_SECONDS = 15 * 60
+# One-shot runs take exactly their SINCE_HOURS window
+COMMENT_WINDOW_HOURS = SINCE_HOURS if ONCE else 12
+SEARCH_MAX_RESULTS = 50
+KEYWORD_WORKERS = int(os.environ.get('YOUTUBE_KEYWORD_WORKERS', 4))
+# Reserved per keyword: one search plus one commentThreads page per returned video. Popular
+# videos need more pages; those are paid from whatever quota the key has left (see KeyLease)
+KEYWORD_BUDGET = QUOTA_COSTS['search'] + SEARCH_MAX_RESULTS * QUOTA_COSTS['commentThreads']
+key_pool = KeyPool(API_KEYS, store=CACHE)
+COMMENT_COLUMNS = ('video_id', 'video_title', 'comment_id', 'comment_time', 'comment_text', 'created_at')
+FETCH_REPLIES = os.environ.get('YOUTUBE_FETCH_REPLIES', '0') == '1'
 
-def search_videos_by_keyword(keyword):
-    if keyword in CACHE:
-        return CACHE[keyword]
-    url = f"https://www.googleapis.com/youtube/v3/search"
+def youtube_get(resource, params, lease, etag=None):
+    url = f"https://www.googleapis.com/youtube/v3/{resource}"
+    headers = {'If-None-Match': etag} if etag else None
+    while True:
+        if not lease.ensure(resource):
+            raise QuotaExhausted(f"No API key has quota left for {resource}")
+        start = time.perf_counter()
+        with metrics.timer('fetch'):
+            response = http_client.get(url, params={**params, "key": lease.key}, headers=headers)
+        metrics.observe(f"youtube_{resource}", time.perf_counter() - start)
+        metrics.inc(f"youtube_http_{response.status_code}")
+        lease.spend(resource)
+        if response.status_code == 403 and is_quota_exceeded(response):
+            print(f"Quota exceeded for API key ...{lease.key[-4:]}, switching key")
+            if lease.rotate():
+                continue
+        return response
+
+def is_quota_exceeded(response):
+    try:
+        errors = response.json()['error']['errors']
+    except (ValueError, KeyError, TypeError):
+        return False
+    return any(error.get('reason') in ('quotaExceeded', 'dailyLimitExceeded') for error in errors)
+
+def search_videos_by_keyword(keyword, lease):
+    cache_key = f"search:{keyword}"
+    cached, etag, fresh = CACHE.get_entry(cache_key)
+    if fresh:
+        return cached
     params = {
         "q": keyword,
         "type": "video",
         "part": "id,snippet",
-        "maxResults": 200,
-        "key": API_KEYS[current_key_index],
+        "maxResults": SEARCH_MAX_RESULTS,
         "alt": "json"
     }
-    response = requests.get(url, params=params)
+    response = youtube_get("search", params, lease, etag if cached is not None else None)
 
+    if response.status_code == 304:
+        CACHE.refresh(cache_key, SEARCH_TTL_SECONDS)
+        return cached
     if response.status_code == 200:
         data = response.json()
         video_data = [{'VideoID': item['id']['videoId'], 'VideoTitle': item['snippet']['title']} for item in data.get('items', [])]
-        CACHE[keyword] = video_data
+        CACHE.set(cache_key, video_data, SEARCH_TTL_SECONDS, data.get('etag'))
         return video_data
     else:
         print(f"Request failed with status code {response.status_code}")
         return []
-def switch_api_key():
-    global current_key_index
-    current_key_index = (current_key_index + 1) % len(API_KEYS)
-    print(API_KEYS[current_key_index])
 
-def get_current_api_key():
-    print(API_KEYS[current_key_index])
-    return API_KEYS[current_key_index]
+def parse_time(published_at):
+    return datetime.fromisoformat(published_at[:-1])
 
-def get_comments(video_data):
+def get_comments(video_data, lease):
+    # Returns the comments and the per-video states to cache once they are committed; caching
+    # last_seen before the insert would make the next run stop short of comments never stored
     comments = []
+    video_states = []
     now = datetime.utcnow()
-    fetch_time = now - timedelta(hours=12)
+    fetch_time = now - timedelta(hours=COMMENT_WINDOW_HOURS)
 
     for video_info in video_data:
+        if budget.expired():
+            print("Run budget exhausted, skipping the remaining videos")
+            break
         video_id = video_info['VideoID']
         video_title = video_info['VideoTitle']
         try:
-            if video_id in CACHE:
-                video_comments = CACHE[video_id]
-            else:
-                video_comments = fetch_comments_for_video(video_id, video_title)
-                CACHE[video_id] = video_comments
-
-            for comment in video_comments:
-                comment_time = datetime.fromisoformat(comment['CommentTime'][:-1]) 
-                if fetch_time <= comment_time <= now:
-                    comments.append(comment)
+            cache_key = f"video:{video_id}"
+            state, etag, fresh = CACHE.get_entry(cache_key)
+            if fresh:
+                continue
+            state = state or {}
+            video_comments, first_page_etag = fetch_comments_for_video(
+                video_id, video_title, fetch_time, lease, state.get('last_seen'), etag)
+            if first_page_etag is not None:
+                if video_comments:
+                    state['last_seen'] = video_comments[0].comment_id
+                video_states.append((cache_key, state, first_page_etag))
+            comments.extend(video_comments)
+        except QuotaExhausted as e:
+            print(f"{e}, skipping the remaining videos")
+            break
         except Exception as e:
             print(f"Error occurred while processing video {video_id}: {e}")
 
-    return comments
+    return comments, video_states
+
+def save_video_states(video_states):
+    for cache_key, state, etag in video_states:
+        CACHE.set(cache_key, state, VIDEO_STATE_TTL_SECONDS, etag)
 
-def fetch_comments_for_video(video_id, video_title):
-    url = f"https://www.googleapis.com/youtube/v3/commentThreads"
+def make_comment(video_id, video_title, comment_id, snippet):
+    return YoutubeComment(video_id, video_title, comment_id, snippet['publishedAt'], snippet['textDisplay'],
+                          parse_time(snippet['publishedAt']).replace(tzinfo=timezone.utc),
+                          snippet.get('authorDisplayName'))
+
+def fetch_comments_for_video(video_id, video_title, since, lease, last_seen_id=None, etag=None):
+    # commentThreads come back newest first, so paging stops at the first thread that is older
+    # than the cutoff or was already stored by a previous run. The first page is requested
+    # conditionally; a 304 means nothing new was posted. The first page's ETag is returned
+    # alongside the comments, or None if paging failed before reaching the cutoff, in which case
+    # the video's state is left alone so the next run pages back as far again.
     params = {
-        "part": "snippet",
+        "part": "snippet,replies" if FETCH_REPLIES else "snippet",
         "videoId": video_id,
         "textFormat": "plainText",
-        "maxResults": 100,
-        "key": API_KEYS[current_key_index]
+        "order": "time",
+        "maxResults": 100
     }
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
+    video_comments = []
+    first_page_etag = None
+    while True:
+        response = youtube_get("commentThreads", params, lease, None if 'pageToken' in params else etag)
+        if response.status_code == 304:
+            return video_comments, etag
+        if response.status_code != 200:
+            print(f"Request failed with status code {response.status_code}")
+            return video_comments, None
         data = response.json()
-        video_comments = [{'VideoID': video_id, 'VideoTitle': video_title, 'CommentID': item['id'],
-                           'CommentTime': item['snippet']['topLevelComment']['snippet']['publishedAt'],
-                           'CommentText': item['snippet']['topLevelComment']['snippet']['textDisplay']}
-                          for item in data.get('items', [])]
-        return video_comments
+        if 'pageToken' not in params:
+            first_page_etag = data.get('etag', '')
+        for item in data.get('items', []):
+            snippet = item['snippet']['topLevelComment']['snippet']
+            if item['id'] == last_seen_id or parse_time(snippet['publishedAt']) < since:
+                return video_comments, first_page_etag
+            video_comments.append(make_comment(video_id, video_title, item['id'], snippet))
+            if FETCH_REPLIES and item['snippet'].get('totalReplyCount', 0) > 0:
+                video_comments.extend(fetch_replies(item, video_id, video_title, since, lease))
+        page_token = data.get('nextPageToken')
+        if not page_token:
+            break
+        params['pageToken'] = page_token
+    return video_comments, first_page_etag
+
+def fetch_replies(item, video_id, video_title, since, lease):
+    # commentThreads inlines up to five replies; only page through comments.list when there are more
+    inline = item.get('replies', {}).get('comments', [])
+    if len(inline) >= item['snippet']['totalReplyCount']:
+        replies = inline
     else:
-        print(f"Request failed with status code {response.status_code}")
-        return []
-def create_table_if_not_exists():
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
+        replies = []
+        params = {
+            "part": "snippet",
+            "parentId": item['id'],
+            "textFormat": "plainText",
+            "maxResults": 100
+        }
+        while True:
+            response = youtube_get("comments", params, lease)
+            if response.status_code != 200:
+                print(f"Request failed with status code {response.status_code}")
+                break
+            data = response.json()
+            replies.extend(data.get('items', []))
+            page_token = data.get('nextPageToken')
+            if not page_token:
+                break
+            params['pageToken'] = page_token
+    return [make_comment(video_id, video_title, reply['id'], reply['snippet'])
+            for reply in replies if parse_time(reply['snippet']['publishedAt']) >= since]
+
+def create_table_if_not_exists(pool):
     create_table_query = '''CREATE TABLE IF NOT EXISTS yt_comments
           (ID SERIAL PRIMARY KEY NOT NULL,
           VIDEO_ID TEXT NOT NULL,
@@ -95,49 +203,70 @@ def create_table_if_not_exists():
           COMMENT_TIME TEXT NOT NULL,
           COMMENT_TEXT TEXT NOT NULL); '''
 
-    cursor.execute(create_table_query)
-    connection.commit()
-    cursor.close()
-    connection.close()
-
-def insert_comments_to_postgres(comments):
-    connection = psycopg2.connect(**DB_CONFIG)
-
-    cursor = connection.cursor()
+    with pooled_connection(pool) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(create_table_query)
+            ensure_unique_index(cursor, 'yt_comments', ('video_id', 'comment_id'))
+            ensure_column(cursor, 'yt_comments', 'created_at', 'timestamptz')
+            ensure_comments_table(cursor)
 
-    for comment in comments:
-        check_query = "SELECT COUNT(*) FROM yt_comments WHERE VIDEO_ID = %s AND COMMENT_ID = %s"
-        check_params = (comment['VideoID'], comment['CommentID'])
-        cursor.execute(check_query, check_params)
-        existing_comments_count = cursor.fetchone()[0]
+def insert_comments_to_postgres(pool, comments):
+    rows = [(comment.video_id, comment.video_title, comment.comment_id, comment.comment_time,
+             comment.comment_text, comment.created_at) for comment in comments]
+    unified = [Comment('youtube', comment.video_id, comment.author, comment.comment_id, comment.created_at,
+                       comment.comment_text) for comment in comments]
+    with metrics.timer('write'), pooled_connection(pool) as connection:
+        with connection.cursor() as cursor:
+            inserted = insert_ignore_conflicts(cursor, 'yt_comments', COMMENT_COLUMNS, rows,
+                                               ('video_id', 'comment_id'), page_size=BATCH_SIZE)
+            load_comments(cursor, unified)
+    metrics.add_rows('write', inserted)
+    return inserted
 
-        if existing_comments_count == 0:
-            insert_query = """INSERT INTO yt_comments (VIDEO_ID, VIDEO_TITLE, COMMENT_ID, COMMENT_TIME, COMMENT_TEXT) 
-                              VALUES (%s, %s, %s, %s, %s)"""
-            record_to_insert = (comment['VideoID'], comment['VideoTitle'], comment['CommentID'],
-                                comment['CommentTime'], comment['CommentText'])
-            cursor.execute(insert_query, record_to_insert)
+def process_keyword(pool, keyword):
+    if budget.expired():
+        return 0
+    lease = key_pool.lease(KEYWORD_BUDGET)
+    if lease is None:
+        print(f"No API key has {KEYWORD_BUDGET} quota units left, skipping keyword {keyword}")
+        return 0
+    try:
+        print(keyword)
+        video_data = search_videos_by_keyword(keyword, lease)
+        comments, video_states = get_comments(video_data, lease)
+        metrics.add_rows('fetch', len(comments))
+        inserted = insert_comments_to_postgres(pool, comments)
+        save_video_states(video_states)
+        print(f"Inserted {inserted} of {len(comments)} comments for keyword {keyword}")
+        return inserted
+    finally:
+        lease.release()
 
-    connection.commit()
-    cursor.close()
-    connection.close()
 def job():
     print("Job is running at", datetime.now())
-    create_table_if_not_exists()
-    r = pd.read_csv("/home/hkatakam/dbtest/Youtube_key.csv")
-    for i in r['title']:
-        print(i)
-        keyword = i  
-        video_data = search_videos_by_keyword(keyword)
-        comments = get_comments(video_data)
-        insert_comments_to_postgres(comments)
-        switch_api_key()
-    CACHE.clear()
+    pool = create_pool(DB_CONFIG, KEYWORD_WORKERS)
+    inserted = {}
+    try:
+        create_table_if_not_exists(pool)
+        r = pd.read_csv("/home/hkatakam/dbtest/Youtube_key.csv")
+        with ThreadPoolExecutor(max_workers=KEYWORD_WORKERS) as executor:
+            for keyword, future in [(keyword, executor.submit(process_keyword, pool, keyword)) for keyword in r['title']]:
+                try:
+                    inserted[keyword] = future.result()
+                except Exception as e:
+                    print(f"Error occurred while processing keyword {keyword}: {e}")
+    finally:
+        pool.closeall()
+    print("Estimated quota left per key:", key_pool.summary())
+    print("Metrics written to", metrics.write(), "-", metrics.summary())
     print("Job is running at", datetime.now())
+    return inserted
 
 if __name__ == '__main__':
     now1 =datetime.now()
     print(now1)
+    if ONCE:
+        finish('youtube', job())
     schedule.every(60).minutes.do(job)
     while True:
         schedule.run_pending()
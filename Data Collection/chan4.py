@@ -1,20 +1,30 @@
 import schedule
 import time
-import requests
+import http_client
 import csv
-import json
-from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
-from html import unescape
+from email.utils import formatdate
+from datetime import datetime, timedelta, timezone
 import psycopg2
+import requests
+from psycopg2.extras import execute_values
+from ratelimit import PriorityScheduler
+from html_clean import clean_comment
+from db import BATCH_SIZE, create_pool, ensure_column, ensure_unique_index, insert_ignore_conflicts, pooled_connection
+from lru import SeenSet
+from records import ChanPost, ChanCatalogEntry, Comment
+from comments_store import ensure_comments_table, load_comments
+from metrics import metrics, sample
+from run_mode import ONCE, SINCE_HOURS, budget, finish
 import pandas as pd
-conn = psycopg2.connect(
-    dbname="aassemble",
-    user="hkatakam",
-    password="BPyjmXf99",
-    host="localhost",
-    port="5432"
-)
+from concurrent.futures import ThreadPoolExecutor
+CHAN_DB_CONFIG = {
+    'dbname': "aassemble",
+    'user': "hkatakam",
+    'password': "BPyjmXf99",
+    'host': "localhost",
+    'port': "5432"
+}
+conn = psycopg2.connect(**CHAN_DB_CONFIG)
 cur = conn.cursor()
 cur.execute('''
     CREATE TABLE IF NOT EXISTS Thread (
@@ -37,90 +47,209 @@ cur.execute('''
         ImageFilename TEXT
     )
 ''')
-def get_threads(board, page):
-    base_url = f"https://a.4cdn.org/{board}/{page}.json"
-    response = requests.get(base_url)
-    print(base_url)
-    if response.status_code == 200:
-        return response.text
-    else:
-        return None
-def get_catalog(board):
-    base_url = f"https://a.4cdn.org/{board}/catalog.json"
-    response = requests.get(base_url)
-    print(base_url)
+# Rows written before the Board column existed keep a NULL board and never collide with new ones
+for table in ('thread', 'catalog'):
+    cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS Board TEXT")
+    ensure_column(cur, table, 'created_at', 'timestamptz')
+    ensure_unique_index(cur, table, ('board', 'postnumber'), dedupe=False)
+ensure_comments_table(cur)
+cur.execute('''
+    CREATE TABLE IF NOT EXISTS chan_board_state (
+        board TEXT PRIMARY KEY,
+        last_modified TEXT,
+        posts_per_second DOUBLE PRECISION,
+        crawled_at DOUBLE PRECISION
+    )
+''')
+cur.execute('''
+    CREATE TABLE IF NOT EXISTS chan_thread_state (
+        board TEXT,
+        thread_no BIGINT,
+        last_modified BIGINT,
+        PRIMARY KEY (board, thread_no)
+    )
+''')
+conn.commit()
+conn.close()
+# Posts of threads seen for the first time are only taken from this recent window; a one-shot
+# run takes its whole SINCE_HOURS window instead
+NEW_THREAD_WINDOW = timedelta(hours=SINCE_HOURS) if ONCE else timedelta(minutes=3)
+BOARD_WORKERS = 8
+# 4chan API rule: no more than one request per second across the whole process
+scheduler = PriorityScheduler(1.0)
+pool = create_pool(CHAN_DB_CONFIG, BOARD_WORKERS)
+# Exponentially weighted posts/second per board; busier boards get their requests served first.
+# Kept in chan_board_state and loaded before each crawl, so one-shot runs have them from the start.
+board_rates = {}
+RATE_SMOOTHING = 0.5
+THREAD_COLUMNS = ('board', 'postnumber', 'comment', 'timestamp', 'name', 'imagefilename', 'created_at')
+CATALOG_COLUMNS = ('board', 'pagenumber', 'postnumber', 'timestamp', 'name', 'comment', 'imagefilename', 'created_at')
+seen_posts = SeenSet(200000)
+session = http_client.get_session('a.4cdn.org', pool_maxsize=BOARD_WORKERS, retries=0)
+
+def get_json(url, if_modified_since=None, priority=0):
+    # Returns (status, json, Last-Modified header); a 304 carries no body
+    # Retried here rather than in the session so every attempt, retries included, waits its turn at the scheduler
+    headers = {'If-Modified-Since': if_modified_since} if if_modified_since else None
+    for attempt in range(http_client.MAX_RETRIES + 1):
+        scheduler.acquire(priority)
+        start = time.perf_counter()
+        try:
+            with metrics.timer('fetch'):
+                response = session.get(url, headers=headers)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == http_client.MAX_RETRIES:
+                raise
+            metrics.inc('4chan_http_error')
+            time.sleep(http_client.retry_delay(None, attempt))
+            continue
+        metrics.observe('4chan', time.perf_counter() - start)
+        metrics.inc(f"4chan_http_{response.status_code}")
+        if sample():
+            print(url, response.status_code)
+        if response.status_code not in http_client.RETRY_STATUSES or attempt == http_client.MAX_RETRIES:
+            break
+        time.sleep(http_client.retry_delay(response, attempt))
     if response.status_code == 200:
-        return response.text
-    else:
-        return None
-def clean_comment(text):
-    soup = BeautifulSoup(text, 'html.parser')
-    cleaned_text = soup.get_text()
-    cleaned_text = unescape(cleaned_text)
-    cleaned_text = cleaned_text.replace(">>", "")
-    cleaned_text = cleaned_text.replace(">", "")
-    return cleaned_text
+        return 200, response.json(), response.headers.get('Last-Modified')
+    return response.status_code, None, None
+def get_threads_index(board, if_modified_since=None):
+    return get_json(f"https://a.4cdn.org/{board}/threads.json", if_modified_since, board_rates.get(board, 0))
+def get_thread(board, thread_no, last_modified=None):
+    since = formatdate(last_modified, usegmt=True) if last_modified else None
+    return get_json(f"https://a.4cdn.org/{board}/thread/{thread_no}.json", since, board_rates.get(board, 0))
+
+def load_board_rates():
+    with pooled_connection(pool) as connection:
+        with connection.cursor() as cur:
+            cur.execute("SELECT board, posts_per_second FROM chan_board_state WHERE posts_per_second IS NOT NULL")
+            board_rates.update(cur.fetchall())
+
+def update_board_rate(cur, board, new_posts, previous_crawl):
+    now = time.time()
+    if previous_crawl is not None and now > previous_crawl:
+        rate = new_posts / (now - previous_crawl)
+        board_rates[board] = RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * board_rates.get(board, rate)
+    cur.execute("""
+        INSERT INTO chan_board_state (board, posts_per_second, crawled_at) VALUES (%s, %s, %s)
+        ON CONFLICT (board) DO UPDATE SET posts_per_second = EXCLUDED.posts_per_second, crawled_at = EXCLUDED.crawled_at
+    """, (board, board_rates.get(board), now))
+
+def load_thread_state(cur, board):
+    cur.execute("SELECT thread_no, last_modified FROM chan_thread_state WHERE board = %s", (board,))
+    return dict(cur.fetchall())
 
-def crawl_4chan(board, limit=10):
+def save_state(cur, board, board_last_modified, changed, gone):
+    if changed:
+        execute_values(cur, """
+            INSERT INTO chan_thread_state (board, thread_no, last_modified) VALUES %s
+            ON CONFLICT (board, thread_no) DO UPDATE SET last_modified = EXCLUDED.last_modified
+        """, [(board, thread_no, last_modified) for thread_no, last_modified in changed.items()])
+    if gone:
+        cur.execute("DELETE FROM chan_thread_state WHERE board = %s AND thread_no = ANY(%s)", (board, list(gone)))
+    cur.execute("""
+        INSERT INTO chan_board_state (board, last_modified) VALUES (%s, %s)
+        ON CONFLICT (board) DO UPDATE SET last_modified = EXCLUDED.last_modified
+    """, (board, board_last_modified))
+
+def crawl_4chan(board):
+    with pooled_connection(pool) as connection:
+        with connection.cursor() as cur:
+            cur.execute("SELECT last_modified, crawled_at FROM chan_board_state WHERE board = %s", (board,))
+            previous_board_modified, previous_crawl = cur.fetchone() or (None, None)
+            posts = crawl_board(cur, board, previous_board_modified)
+            update_board_rate(cur, board, len(posts), previous_crawl)
+    for post in posts:
+        seen_posts.add((board, post.postnumber))
+    return len(posts)
+
+def crawl_board(cur, board, previous_board_modified):
+    # Poll threads.json and only download threads whose last_modified moved since the previous crawl
+    status, index, board_last_modified = get_threads_index(board, previous_board_modified)
+    if status == 304:
+        print(f"/{board}/ unchanged")
+        return []
+    if index is None:
+        print(f"Failed to fetch /{board}/threads.json: {status}")
+        return []
+    known = load_thread_state(cur, board)
+    new_thread_cutoff = (datetime.now() - NEW_THREAD_WINDOW).timestamp()
     posts = []
     catalogs = []
-    page = 1
-    current_time = datetime.now()
-    while len(posts) < limit:
-        threads = get_threads(board, page)
-        if not threads:
-            break
-        json_data = json.loads(threads)
-        for thread in json_data['threads']:
-            for post in thread['posts']:
-                timestamp = datetime.fromtimestamp(post.get('time', 0))
-                if current_time - timestamp < timedelta(minutes=3):
-                    post_info = {
-                        'Post Number': post.get('no', ''),
-                        'Comment': clean_comment(post.get('com', '')),
-                        'Timestamp': post.get('now', ''),
-                        'Name': post.get('name', ''),
-                        'Image Filename': post.get('filename', ''),
-                    }
+    changed = {}
+    listed = set()
+    skipped = 0
+    for page in index:
+        for thread in page['threads']:
+            thread_no = thread['no']
+            listed.add(thread_no)
+            previous = known.get(thread_no)
+            if previous is not None and thread['last_modified'] <= previous:
+                continue
+            # Threads left unfetched keep their old state and are picked up by the next run
+            if budget.expired():
+                skipped += 1
+                continue
+            status, thread_data, _ = get_thread(board, thread_no, previous)
+            if status == 304:
+                changed[thread_no] = thread['last_modified']
+                continue
+            if thread_data is None:
+                skipped += 1
+                continue
+            cutoff = previous if previous is not None else new_thread_cutoff
+            with metrics.timer('clean'):
+                for post in thread_data['posts']:
+                    if post.get('time', 0) <= cutoff or (board, post.get('no')) in seen_posts:
+                        continue
+                    post_info = ChanPost(
+                        board,
+                        post.get('no', ''),
+                        clean_comment(post.get('com', '')),
+                        post.get('now', ''),
+                        post.get('name', ''),
+                        post.get('filename', ''),
+                        datetime.fromtimestamp(post.get('time', 0), timezone.utc),
+                    )
                     posts.append(post_info)
-        page += 1
-    catalogs_data = get_catalog(board)
-    if catalogs_data:
-        catalog_json = json.loads(catalogs_data)
-        for page in catalog_json:
-            for thread in page['threads']:
-                timestamp = datetime.fromtimestamp(thread.get('time', 0))
-                if current_time - timestamp < timedelta(minutes=3):
-                    catalog_info = {
-                        'Page Number': page['page'],
-                        'Post Number': thread.get('no', ''),
-                        'Timestamp': thread.get('now', ''),
-                        'Name': thread.get('name', ''),
-                        'Comment': clean_comment(thread.get('com', '')),
-                        'Image Filename': thread.get('filename', ''),
-                    }
-                    catalogs.append(catalog_info)
-
-    for post in posts[:limit]:
-        cur.execute(
-            "INSERT INTO Thread (PostNumber, Comment, Timestamp, Name, ImageFilename) VALUES (%s, %s, %s, %s, %s)",
-            (post['Post Number'], post['Comment'], post['Timestamp'], post['Name'], post['Image Filename'])
-        )
+                    if post.get('no') == thread_no:
+                        catalogs.append(ChanCatalogEntry(
+                            board, page['page'], post_info.postnumber, post_info.timestamp,
+                            post_info.name, post_info.comment, post_info.imagefilename, post_info.created_at))
+            changed[thread_no] = thread['last_modified']
 
-    for catalog in catalogs:
-        cur.execute(
-            "INSERT INTO Catalog (PageNumber, PostNumber, Timestamp, Name, Comment, ImageFilename) VALUES (%s, %s, %s, %s, %s, %s)",
-            (catalog['Page Number'], catalog['Post Number'], catalog['Timestamp'], catalog['Name'], catalog['Comment'], catalog['Image Filename'])
-        )
-    conn.commit()
+    metrics.add_rows('clean', len(posts))
+    with metrics.timer('write'):
+        inserted = insert_ignore_conflicts(cur, 'thread', THREAD_COLUMNS, posts, ('board', 'postnumber'), page_size=BATCH_SIZE)
+        load_comments(cur, (Comment('4chan', post.board, post.name, str(post.postnumber), post.created_at, post.comment)
+                            for post in posts))
+        insert_ignore_conflicts(cur, 'catalog', CATALOG_COLUMNS, catalogs, ('board', 'postnumber'), page_size=BATCH_SIZE)
+    metrics.add_rows('write', inserted)
+    # Keep the old Last-Modified while threads are outstanding, otherwise a quiet board answers
+    # the next poll with 304 and they are not retried until it changes again
+    if skipped:
+        board_last_modified = previous_board_modified
+    save_state(cur, board, board_last_modified, changed, set(known) - listed)
+    print(f"/{board}/: {len(changed)} changed threads, {skipped} left for the next crawl, {inserted} new posts")
+    return posts
 def main():
+    # Every board is in flight at once; the shared scheduler decides whose request goes next
     r = pd.read_csv("boards.csv")
-    for redd in r['title']:
-        print(redd)
-        board_name = redd  
-        number_of_posts = 10  
-        crawl_4chan(board_name, number_of_posts)
+    boards = list(r['title'])
+    load_board_rates()
+    inserted = {}
+    with ThreadPoolExecutor(max_workers=BOARD_WORKERS) as executor:
+        futures = [(board, executor.submit(crawl_4chan, board)) for board in boards]
+        for board, future in futures:
+            try:
+                inserted[board] = future.result()
+            except Exception as e:
+                print(f"Error crawling /{board}/: {e}")
+    print("Metrics written to", metrics.write(), "-", metrics.summary())
+    return inserted
 if __name__ == "__main__":
+    if ONCE:
+        finish('4chan', main())
     main()
     schedule.every(3).minutes.do(main)
     while True:
@@ -0,0 +1,54 @@
+import sys
+import json
+import time
+from bs4 import BeautifulSoup
+from html import unescape
+from html_clean import clean_comment, clean_comments
+
+CORPUS_PATH = 'chan4_corpus.json'
+REPEAT = 200
+
+
+def reference_clean_comment(text):
+    # The BeautifulSoup implementation chan4.py used before html_clean
+    soup = BeautifulSoup(text, 'html.parser')
+    cleaned_text = soup.get_text()
+    cleaned_text = unescape(cleaned_text)
+    cleaned_text = cleaned_text.replace(">>", "")
+    cleaned_text = cleaned_text.replace(">", "")
+    return cleaned_text
+
+
+def check_parity(corpus):
+    mismatches = [(text, reference_clean_comment(text), clean_comment(text))
+                  for text in corpus if reference_clean_comment(text) != clean_comment(text)]
+    for text, expected, actual in mismatches:
+        print(f"MISMATCH {text!r}\n  expected {expected!r}\n  actual   {actual!r}")
+    return not mismatches
+
+
+def timed(function, texts):
+    start = time.perf_counter()
+    function(texts)
+    return time.perf_counter() - start
+
+
+def main():
+    corpus_path = sys.argv[1] if len(sys.argv) > 1 else CORPUS_PATH
+    with open(corpus_path, encoding='utf-8') as f:
+        corpus = json.load(f)
+    if not check_parity(corpus):
+        sys.exit(1)
+    print(f"Parity OK on {len(corpus)} comments")
+
+    texts = corpus * REPEAT
+    reference = timed(lambda batch: [reference_clean_comment(text) for text in batch], texts)
+    fast = timed(clean_comments, texts)
+    print(f"{len(texts)} comments")
+    print(f"BeautifulSoup: {reference:.3f}s ({len(texts) / reference:,.0f} comments/s)")
+    print(f"html_clean:    {fast:.3f}s ({len(texts) / fast:,.0f} comments/s)")
+    print(f"Speedup:       {reference / fast:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+from datetime import datetime, timezone
+from psycopg2 import sql
+from db import BATCH_SIZE, insert_ignore_conflicts
+
+# One normalized fact table for every platform, list-partitioned by platform and then
+# range-partitioned by month, e.g. comments -> comments_reddit -> comments_reddit_2025_08.
+# Queries filtered on platform/created_at only touch the partitions they need, and an old
+# month can be detached without rewriting anything.
+COMMENTS_TABLE = 'comments'
+COMMENT_COLUMNS = ('platform', 'source', 'author', 'external_id', 'created_at', 'body')
+PLATFORMS = ('reddit', 'youtube', '4chan')
+
+
+def platform_table(platform):
+    return f"{COMMENTS_TABLE}_{platform}"
+
+
+def month_table(platform, year, month):
+    return f"{platform_table(platform)}_{year:04d}_{month:02d}"
+
+
+def lock_partitions(cursor, name):
+    # Collectors and pooled threads create partitions concurrently; serialize on the name until
+    # commit so the second one sees the first one's table instead of failing on it
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (name,))
+
+
+def ensure_comments_table(cursor):
+    lock_partitions(cursor, COMMENTS_TABLE)
+    cursor.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {} (
+            platform TEXT NOT NULL,
+            source TEXT NOT NULL,
+            author TEXT,
+            external_id TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL,
+            body TEXT,
+            PRIMARY KEY (platform, source, external_id, created_at)
+        ) PARTITION BY LIST (platform)
+    """).format(sql.Identifier(COMMENTS_TABLE)))
+    for platform in PLATFORMS:
+        cursor.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES IN (%s) PARTITION BY RANGE (created_at)
+        """).format(sql.Identifier(platform_table(platform)), sql.Identifier(COMMENTS_TABLE)), (platform,))
+    cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (created_at)").format(
+        sql.Identifier(f"{COMMENTS_TABLE}_created_at_idx"),
+        sql.Identifier(COMMENTS_TABLE)
+    ))
+
+
+def ensure_month_partitions(cursor, platform, months):
+    # Looked up on every batch rather than cached in the process: a partition created in a
+    # transaction that rolls back must be created again
+    names = {month_table(platform, year, month): (year, month) for year, month in sorted(set(months))}
+    cursor.execute("""
+        SELECT name FROM unnest(%s::text[]) AS t(name) WHERE to_regclass(name) IS NULL ORDER BY name
+    """, (list(names),))
+    for (name,) in cursor.fetchall():
+        lock_partitions(cursor, name)
+        year, month = names[name]
+        start = datetime(year, month, 1, tzinfo=timezone.utc)
+        end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+        cursor.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)
+        """).format(sql.Identifier(name), sql.Identifier(platform_table(platform))), (start, end))
+
+
+def detach_month(cursor, platform, year, month):
+    cursor.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(
+        sql.Identifier(platform_table(platform)),
+        sql.Identifier(month_table(platform, year, month))
+    ))
+
+
+def load_comments(cursor, comments):
+    # comments: iterable of records.Comment; written in the caller's transaction
+    comments = list(comments)
+    if not comments:
+        return 0
+    months = {}
+    for comment in comments:
+        months.setdefault(comment.platform, set()).add((comment.created_at.year, comment.created_at.month))
+    for platform, platform_months in months.items():
+        ensure_month_partitions(cursor, platform, platform_months)
+    return insert_ignore_conflicts(cursor, COMMENTS_TABLE, COMMENT_COLUMNS, comments,
+                                   ('platform', 'source', 'external_id', 'created_at'), page_size=BATCH_SIZE)
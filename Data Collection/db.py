@@ -0,0 +1,84 @@
+import logging
+from contextlib import contextmanager
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+BATCH_SIZE = 1000
+
+
+def ensure_unique_index(cursor, table_name, columns, dedupe=True):
+    # Drop duplicates left over from the per-row insert path before the index can be built
+    index_name = f"{table_name}_{'_'.join(columns)}_key".lower()
+    cursor.execute("SELECT to_regclass(%s)", (index_name,))
+    if cursor.fetchone()[0] is not None:
+        return
+    key = sql.SQL(', ').join(map(sql.Identifier, columns))
+    if dedupe:
+        remove_duplicates(cursor, table_name, key)
+    cursor.execute(sql.SQL("CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} ({})").format(
+        sql.Identifier(index_name),
+        sql.Identifier(table_name),
+        key
+    ))
+
+
+def ensure_column(cursor, table_name, column_name, data_type):
+    # ALTER TABLE takes an exclusive lock even when the column exists, queueing every reader and
+    # writer of the table behind it; only run it when the column is actually missing
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+    """, (table_name, column_name))
+    if cursor.fetchone() is not None:
+        return
+    cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} {}").format(
+        sql.Identifier(table_name),
+        sql.Identifier(column_name),
+        sql.SQL(data_type)
+    ))
+
+
+def remove_duplicates(cursor, table_name, key):
+    dedupe_query = sql.SQL("""
+        DELETE FROM {table} t
+        USING (
+            SELECT ctid, row_number() OVER (PARTITION BY {key} ORDER BY ctid) AS rn
+            FROM {table}
+        ) d
+        WHERE t.ctid = d.ctid AND d.rn > 1
+    """).format(table=sql.Identifier(table_name), key=key)
+    cursor.execute(dedupe_query)
+    if cursor.rowcount:
+        logging.info(f"Removed {cursor.rowcount} duplicate row(s) from {table_name}.")
+
+
+def insert_ignore_conflicts(cursor, table_name, columns, rows, conflict_columns, page_size=BATCH_SIZE):
+    # One multi-row INSERT per page; rows already present are skipped by the unique index
+    insert_query = sql.SQL("INSERT INTO {} ({}) VALUES %s ON CONFLICT ({}) DO NOTHING").format(
+        sql.Identifier(table_name),
+        sql.SQL(', ').join(map(sql.Identifier, columns)),
+        sql.SQL(', ').join(map(sql.Identifier, conflict_columns))
+    ).as_string(cursor)
+    if not rows:
+        return 0
+    inserted = execute_values(cursor, insert_query + " RETURNING 1", rows, page_size=page_size, fetch=True)
+    return len(inserted)
+
+
+def create_pool(db_config, maxconn):
+    return ThreadedConnectionPool(1, maxconn, **db_config)
+
+
+@contextmanager
+def pooled_connection(pool):
+    # Commit on success, roll back on error, and always hand the connection back to the pool
+    connection = pool.getconn()
+    try:
+        yield connection
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        pool.putconn(connection)
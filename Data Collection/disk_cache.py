@@ -0,0 +1,72 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class DiskCache:
+    # SQLite-backed key/value store with per-entry TTLs and an LRU cap on the number of entries.
+    # Expired entries are kept (until evicted) so their ETag can still be used for revalidation.
+    def __init__(self, path, max_entries=50000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                etag TEXT,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self.connection.commit()
+
+    def get_entry(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, etag, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, None, False
+            now = time.time()
+            self.connection.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+        value, etag, expires_at = row
+        return json.loads(value), etag, now < expires_at
+
+    def get(self, key):
+        value, _, fresh = self.get_entry(key)
+        return value if fresh else None
+
+    def set(self, key, value, ttl, etag=None):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, etag, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value), etag, now + ttl, now)
+            )
+            self._evict()
+            self.connection.commit()
+
+    def refresh(self, key, ttl):
+        # Resource revalidated (HTTP 304): keep the stored value and push the expiry forward
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "UPDATE cache SET expires_at = ?, accessed_at = ? WHERE key = ?", (now + ttl, now, key)
+            )
+            self.connection.commit()
+
+    def _evict(self):
+        self.connection.execute("""
+            DELETE FROM cache WHERE key IN (
+                SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
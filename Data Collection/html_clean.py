@@ -0,0 +1,34 @@
+import re
+from html import unescape
+from html.entities import html5
+
+# 4chan comment bodies only use a handful of tags (<br>, <wbr>, <a class="quotelink">,
+# <span class="quote">, <s>, <b>, <u>, <pre>) with all user text entity-escaped, so removing
+# anything that looks like a tag gives the same text as building a parse tree.
+TAG_RE = re.compile(r'</?[a-zA-Z][^>]*>|<![^>]*>|<\?[^>]*>')
+NAMED_REF_RE = re.compile(r'&([a-zA-Z][-.a-zA-Z0-9]*);')
+
+
+def _keep_unknown_ref(match):
+    # html.parser turns an unknown '&name;' into the literal '&name', dropping the semicolon
+    return match.group(0) if match.group(1) + ';' in html5 else '&' + match.group(1)
+
+
+def clean_comment(text):
+    # Same output as BeautifulSoup(text, 'html.parser').get_text() followed by unescape()
+    # and stripping '>' characters, which is what chan4.clean_comment used to do
+    if not text:
+        return ''
+    if '<' in text:
+        text = TAG_RE.sub('', text)
+    if '&' in text:
+        if ';' in text:
+            text = NAMED_REF_RE.sub(_keep_unknown_ref, text)
+        text = unescape(text)
+        if '&' in text:
+            text = unescape(text)
+    return text.replace('>', '')
+
+
+def clean_comments(texts):
+    return [clean_comment(text) for text in texts]
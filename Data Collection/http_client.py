@@ -0,0 +1,117 @@
+import os
+import time
+import logging
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = 'myproj/0.0.1'
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT_SEC', 5))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT_SEC', 30))
+MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))
+# Wait before retrying a 429 that carries no Retry-After header
+RATE_LIMIT_SLEEP_SEC = float(os.environ.get('RATE_LIMIT_SLEEP_SEC', 3))
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class RateLimitRetry(Retry):
+    def sleep(self, response=None):
+        if response is not None and response.status == 429 and not response.headers.get('Retry-After'):
+            time.sleep(max(RATE_LIMIT_SLEEP_SEC, self.get_backoff_time()))
+            return
+        super().sleep(response)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def get_session(host, pool_maxsize=POOL_MAXSIZE, retries=MAX_RETRIES, timeout=None):
+    # One keep-alive session per host, shared by every thread in the process
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            retry = RateLimitRetry(
+                total=retries,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=None,
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = TimeoutHTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry, timeout=timeout)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'})
+            _sessions[host] = session
+        return session
+
+
+def retry_delay(response, attempt):
+    # Same waits as RateLimitRetry, for callers that retry by hand (response is None after a connection error)
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                pass
+        if response.status_code == 429:
+            return max(RATE_LIMIT_SLEEP_SEC, BACKOFF_FACTOR * 2 ** attempt)
+    return BACKOFF_FACTOR * 2 ** attempt
+
+
+def get(url, **kwargs):
+    return get_session(urlsplit(url).netloc).get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_session(urlsplit(url).netloc).post(url, **kwargs)
+
+
+class OAuthToken:
+    def __init__(self, token_url, client_id, client_secret, data, refresh_margin=TOKEN_REFRESH_MARGIN_SECONDS):
+        self.token_url = token_url
+        self.auth = requests.auth.HTTPBasicAuth(client_id, client_secret)
+        self.data = data
+        self.refresh_margin = refresh_margin
+        self.access_token = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        response = post(self.token_url, auth=self.auth, data=self.data)
+        response.raise_for_status()
+        token = response.json()
+        if 'access_token' not in token:
+            raise requests.exceptions.HTTPError(f"Token endpoint returned no access_token: {token.get('error')}")
+        self.access_token = token['access_token']
+        expires_in = float(token.get('expires_in', 3600))
+        self.expires_at = time.monotonic() + max(expires_in - self.refresh_margin, expires_in / 2)
+        logging.info(f"Obtained OAuth token from {self.token_url}, valid for {int(expires_in)} seconds.")
+
+    def invalidate(self):
+        with self.lock:
+            self.expires_at = 0.0
+
+    def headers(self):
+        with self.lock:
+            if self.access_token is None or time.monotonic() >= self.expires_at:
+                self.refresh()
+            return {'Authorization': f'Bearer {self.access_token}'}
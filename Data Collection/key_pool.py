@@ -0,0 +1,157 @@
+import hashlib
+import threading
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+# YouTube Data API v3 quota units per call; the daily allowance resets at midnight Pacific time
+QUOTA_COSTS = {'search': 100, 'videos': 1, 'commentThreads': 1, 'comments': 1}
+DAILY_QUOTA = 10000
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+def key_id(key):
+    # Stored instead of the API key itself
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+class KeyPool:
+    # With a store (a DiskCache), spent quota and retired keys are saved per Pacific day, so a
+    # process started later the same day (the hourly --once runs) does not start every key at
+    # the full allowance and rediscover the exhausted ones through 403s
+    def __init__(self, keys, daily_quota=DAILY_QUOTA, store=None):
+        self.keys = list(keys)
+        self.daily_quota = daily_quota
+        self.store = store
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.day = datetime.now(QUOTA_TIMEZONE).date()
+        self.used = {key: 0 for key in self.keys}
+        self.reserved = {key: 0 for key in self.keys}
+        self.exhausted = set()
+        saved = self.store.get(self._store_key()) if self.store is not None else None
+        if saved:
+            for key in self.keys:
+                self.used[key] = min(self.daily_quota, saved['used'].get(key_id(key), 0))
+                if key_id(key) in saved['exhausted']:
+                    self.exhausted.add(key)
+
+    def _store_key(self):
+        return f"quota:{self.day.isoformat()}"
+
+    def _save(self):
+        if self.store is None:
+            return
+        # Kept until the day's quota has reset
+        next_reset = datetime.combine(self.day + timedelta(days=1), time(), QUOTA_TIMEZONE)
+        ttl = (next_reset - datetime.now(QUOTA_TIMEZONE)).total_seconds() + 3600
+        self.store.set(self._store_key(), {
+            'used': {key_id(key): used for key, used in self.used.items()},
+            'exhausted': [key_id(key) for key in self.exhausted],
+        }, ttl)
+
+    def _check_day(self):
+        if datetime.now(QUOTA_TIMEZONE).date() != self.day:
+            reserved = self.reserved
+            self._reset()
+            self.reserved = reserved
+
+    def available(self, key):
+        return self.daily_quota - self.used[key] - self.reserved[key]
+
+    def headroom(self, key, own_reservation):
+        # Units a lease holding own_reservation on key may still spend
+        with self.lock:
+            if key in self.exhausted:
+                return 0
+            return self.available(key) + own_reservation
+
+    def _take(self, budget, exclude=()):
+        candidates = [key for key in self.keys if key not in self.exhausted and key not in exclude]
+        if not candidates:
+            return None
+        key = max(candidates, key=self.available)
+        if self.available(key) < budget:
+            return None
+        self.reserved[key] += budget
+        return key
+
+    def lease(self, budget):
+        with self.lock:
+            self._check_day()
+            key = self._take(budget)
+        return KeyLease(self, key, budget) if key is not None else None
+
+    def spend(self, key, cost, reserved):
+        # reserved: the part of cost paid out of the lease's reservation
+        with self.lock:
+            self.used[key] += cost
+            self.reserved[key] = max(0, self.reserved[key] - reserved)
+
+    def mark_exhausted(self, key):
+        with self.lock:
+            self.exhausted.add(key)
+            self.used[key] = self.daily_quota
+            self._save()
+
+    def release(self, key, budget):
+        with self.lock:
+            self.reserved[key] = max(0, self.reserved[key] - budget)
+            self._save()
+
+    def swap(self, key, budget, new_budget=None):
+        # Gives back budget on key and reserves new_budget (default: the same) on another key
+        with self.lock:
+            self.reserved[key] = max(0, self.reserved[key] - budget)
+            return self._take(budget if new_budget is None else new_budget, exclude=(key,))
+
+    def summary(self):
+        with self.lock:
+            return {key[-4:]: ('exhausted' if key in self.exhausted else self.daily_quota - self.used[key])
+                    for key in self.keys}
+
+
+class KeyLease:
+    # budget is reserved up front so parallel keywords spread over the keys, but it is a floor,
+    # not a cap: calls beyond it are paid from the key's unreserved quota, and ensure() moves the
+    # lease to another key before a call the current one can no longer pay for
+    def __init__(self, pool, key, budget):
+        self.pool = pool
+        self.key = key
+        self.budget = budget
+
+    def spend(self, resource):
+        cost = QUOTA_COSTS.get(resource, 1)
+        reserved = min(cost, self.budget)
+        self.budget -= reserved
+        self.pool.spend(self.key, cost, reserved)
+
+    def ensure(self, resource):
+        cost = QUOTA_COSTS.get(resource, 1)
+        if self.pool.headroom(self.key, self.budget) >= cost:
+            return True
+        key = self.pool.swap(self.key, self.budget, cost)
+        if key is None:
+            self.budget = 0
+            return False
+        self.key = key
+        self.budget = cost
+        return True
+
+    def rotate(self):
+        # Called when the current key reports quotaExceeded: retire it and move to the next best key
+        self.pool.mark_exhausted(self.key)
+        key = self.pool.swap(self.key, self.budget)
+        if key is None:
+            self.budget = 0
+            return False
+        self.key = key
+        return True
+
+    def release(self):
+        self.pool.release(self.key, self.budget)
@@ -0,0 +1,28 @@
+import threading
+from collections import OrderedDict
+
+
+class SeenSet:
+    # Bounded set of recently seen keys; the least recently seen key is dropped once full
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.keys = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, key):
+        # Returns True if the key was not already present
+        with self.lock:
+            if key in self.keys:
+                self.keys.move_to_end(key)
+                return False
+            self.keys[key] = None
+            if len(self.keys) > self.maxsize:
+                self.keys.popitem(last=False)
+            return True
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Per-process timers, counters and latency histograms for each pipeline stage (fetch, parse,
+# clean, score, classify, write). write() leaves a Prometheus text file (or JSON) named after
+# the Airflow task in METRICS_DIR, where a node exporter textfile collector or the next task
+# can pick it up. The analysis scripts import this module from the collection directory,
+# which the DAG puts on their PYTHONPATH.
+METRICS_DIR = os.getenv('METRICS_DIR', 'metrics')
+METRICS_FORMAT = os.getenv('METRICS_FORMAT', 'prom')
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.001'))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = 'pipeline'
+
+
+def sample(rate=LOG_SAMPLE_RATE):
+    # For replacing per-item log lines: True for roughly one call in 1/rate
+    return random.random() < rate
+
+
+def default_job():
+    # Airflow exports the task id to BashOperator commands
+    return os.getenv('AIRFLOW_CTX_TASK_ID') or os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    def __init__(self, job=None):
+        self.job = job or default_job()
+        self.started = time.time()
+        self.stage_seconds = {}
+        self.stage_calls = {}
+        self.rows = {}
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + elapsed
+                self.stage_calls[stage] = self.stage_calls.get(stage, 0) + 1
+
+    def add_rows(self, stage, count):
+        with self.lock:
+            self.rows[stage] = self.rows.get(stage, 0) + count
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.histograms.setdefault(name, Histogram()).observe(seconds)
+
+    def rows_per_second(self, stage):
+        seconds = self.stage_seconds.get(stage)
+        return self.rows.get(stage, 0) / seconds if seconds else 0.0
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'job': self.job,
+                'started': self.started,
+                'elapsed_seconds': time.time() - self.started,
+                'stages': {
+                    stage: {
+                        'seconds': seconds,
+                        'calls': self.stage_calls[stage],
+                        'rows': self.rows.get(stage, 0),
+                        'rows_per_second': self.rows_per_second(stage),
+                    } for stage, seconds in self.stage_seconds.items()
+                },
+                'rows': dict(self.rows),
+                'counters': dict(self.counters),
+                'latency_seconds': {
+                    name: {'count': histogram.count, 'sum': histogram.sum,
+                           'buckets': {str(bound): count for bound, count in histogram.cumulative()}}
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self):
+        job = f'job="{self.job}"'
+        lines = []
+
+        def family(name, kind, samples):
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            lines.extend(f"{PREFIX}_{name}{{{labels}}} {value}" for labels, value in samples)
+
+        with self.lock:
+            family('stage_seconds_total', 'counter',
+                   [(f'{job},stage="{stage}"', seconds) for stage, seconds in self.stage_seconds.items()])
+            family('stage_calls_total', 'counter',
+                   [(f'{job},stage="{stage}"', calls) for stage, calls in self.stage_calls.items()])
+            family('rows_total', 'counter', [(f'{job},stage="{stage}"', rows) for stage, rows in self.rows.items()])
+            family('rows_per_second', 'gauge',
+                   [(f'{job},stage="{stage}"', self.rows_per_second(stage)) for stage in self.rows])
+            family('events_total', 'counter', [(f'{job},event="{name}"', value) for name, value in self.counters.items()])
+            lines.append(f"# TYPE {PREFIX}_api_latency_seconds histogram")
+            for name, histogram in self.histograms.items():
+                for bound, count in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(f'{PREFIX}_api_latency_seconds_bucket{{{job},api="{name}",le="{le}"}} {count}')
+                lines.append(f'{PREFIX}_api_latency_seconds_sum{{{job},api="{name}"}} {histogram.sum}')
+                lines.append(f'{PREFIX}_api_latency_seconds_count{{{job},api="{name}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory=METRICS_DIR, fmt=METRICS_FORMAT):
+        # Written to a temporary file and renamed, so a collector never reads half a file
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.job}.{'json' if fmt == 'json' else 'prom'}")
+        content = json.dumps(self.to_dict(), indent=2) if fmt == 'json' else self.to_prometheus()
+        with open(path + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def summary(self):
+        return ', '.join(f"{stage} {rows} rows ({self.rows_per_second(stage):,.0f}/s)"
+                         for stage, rows in self.rows.items())
+
+
+metrics = Metrics()
@@ -0,0 +1,83 @@
+import sys
+import time
+import logging
+import psycopg2
+from psycopg2 import sql
+from Data_config import DB_CONFIG, TARGET_TABLE
+from db import ensure_column
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Online migration: add a typed created_at timestamptz to every raw table, backfill it from the
+# existing text/naive columns in small id-range chunks (one short transaction each, so collectors
+# keep writing), then build the indexes with CREATE INDEX CONCURRENTLY.
+CHUNK_SIZE = 10000
+PAUSE_SECONDS = 0.1
+
+# 4chan's `now` field looks like 10/18/26(Sun)12:34:56 and is in US Eastern time
+CHAN_NOW_PATTERN = r'^\d{2}/\d{2}/\d{2}\(\w+\)\d{2}:\d{2}:\d{2}$'
+CHAN_NOW_EXPRESSION = (
+    "to_timestamp(regexp_replace(timestamp, '\\(\\w+\\)', ' '), 'MM/DD/YY HH24:MI:SS')::timestamp"
+    " AT TIME ZONE 'America/New_York'"
+)
+
+TABLES = {
+    'yt_comments': ("comment_time::timestamptz", "comment_time IS NOT NULL"),
+    'thread': (CHAN_NOW_EXPRESSION, f"timestamp ~ '{CHAN_NOW_PATTERN}'"),
+    'catalog': (CHAN_NOW_EXPRESSION, f"timestamp ~ '{CHAN_NOW_PATTERN}'"),
+}
+REDDIT_SOURCE = ("created_utc AT TIME ZONE 'UTC'", "created_utc IS NOT NULL")
+
+
+def backfill(connection, table_name, expression, condition):
+    cursor = connection.cursor()
+    ensure_column(cursor, table_name, 'created_at', 'timestamptz')
+    connection.commit()
+    cursor.execute(sql.SQL("SELECT min(id), max(id) FROM {}").format(sql.Identifier(table_name)))
+    low, high = cursor.fetchone()
+    if low is None:
+        logging.info(f"{table_name}: empty, nothing to backfill")
+        return
+    update_query = sql.SQL("""
+        UPDATE {table} SET created_at = {expression}
+        WHERE id >= %s AND id < %s AND created_at IS NULL AND {condition}
+    """).format(table=sql.Identifier(table_name), expression=sql.SQL(expression), condition=sql.SQL(condition))
+    updated = 0
+    for start in range(low, high + 1, CHUNK_SIZE):
+        cursor.execute(update_query, (start, start + CHUNK_SIZE))
+        updated += cursor.rowcount
+        connection.commit()
+        time.sleep(PAUSE_SECONDS)
+    logging.info(f"{table_name}: backfilled created_at on {updated} row(s)")
+
+
+def create_index(connection, table_name):
+    # CONCURRENTLY cannot run inside a transaction block
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} (created_at)").format(
+                sql.Identifier(f"{table_name}_created_at_idx"),
+                sql.Identifier(table_name)
+            ))
+    finally:
+        connection.autocommit = False
+    logging.info(f"{table_name}: index on created_at ready")
+
+
+def main():
+    # Extra Reddit-shaped tables (e.g. politics) can be passed on the command line
+    tables = dict(TABLES)
+    for reddit_table in [TARGET_TABLE] + sys.argv[1:]:
+        tables[reddit_table] = REDDIT_SOURCE
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        for table_name, (expression, condition) in tables.items():
+            backfill(connection, table_name, expression, condition)
+            create_index(connection, table_name)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
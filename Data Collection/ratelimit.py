@@ -0,0 +1,87 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.default_rate = capacity / period
+        self.rate = self.default_rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def update(self, remaining, reset):
+        # The server's view of the window is authoritative: never hold more tokens than it
+        # has left, and spread whatever remains evenly until the window resets
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return
+            self._refill(now)
+            if remaining < 1:
+                self.tokens = 0.0
+                self.rate = self.default_rate
+                self.blocked_until = now + max(1.0, reset)
+                self.updated = self.blocked_until
+                return
+            self.tokens = min(self.tokens, remaining)
+            self.rate = max(remaining - self.tokens, 1.0) / max(reset, 1.0)
+
+    def update_from_headers(self, headers, remaining_header='X-Ratelimit-Remaining', reset_header='X-Ratelimit-Reset'):
+        remaining = headers.get(remaining_header)
+        reset = headers.get(reset_header)
+        if remaining is None or reset is None:
+            return
+        try:
+            self.update(float(remaining), float(reset))
+        except ValueError:
+            pass
+
+
+class PriorityScheduler:
+    # Hands out one request slot per interval across all threads; when several callers are
+    # waiting, the one with the highest priority goes first (FIFO among equal priorities)
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_slot = time.monotonic()
+        self.waiting = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def acquire(self, priority=0):
+        with self.condition:
+            entry = (-priority, next(self.counter))
+            heapq.heappush(self.waiting, entry)
+            while True:
+                now = time.monotonic()
+                if self.waiting[0] == entry:
+                    if now >= self.next_slot:
+                        heapq.heappop(self.waiting)
+                        self.next_slot = max(now, self.next_slot) + self.interval
+                        self.condition.notify_all()
+                        return
+                    self.condition.wait(self.next_slot - now)
+                else:
+                    self.condition.wait()
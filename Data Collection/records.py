@@ -0,0 +1,9 @@
+from collections import namedtuple
+
+# Lightweight row records passed from the collectors straight to the database writers
+RedditComment = namedtuple('RedditComment', ['subreddit', 'post_id', 'body', 'score', 'created_utc', 'comment_id', 'author'])
+YoutubeComment = namedtuple('YoutubeComment', ['video_id', 'video_title', 'comment_id', 'comment_time', 'comment_text', 'created_at', 'author'])
+ChanPost = namedtuple('ChanPost', ['board', 'postnumber', 'comment', 'timestamp', 'name', 'imagefilename', 'created_at'])
+ChanCatalogEntry = namedtuple('ChanCatalogEntry', ['board', 'pagenumber', 'postnumber', 'timestamp', 'name', 'comment', 'imagefilename', 'created_at'])
+# Row of the unified, partitioned comments table (see comments_store.py)
+Comment = namedtuple('Comment', ['platform', 'source', 'author', 'external_id', 'created_at', 'body'])
@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# Collectors normally poll forever on a schedule. With --once (how Airflow runs them) they
+# collect the last SINCE_HOURS hours a single time, stop starting new work once RUN_BUDGET_SEC
+# is used up, print a row-count summary and exit so the hourly task can finish.
+SINCE_HOURS = float(os.environ.get('SINCE_HOURS', 1))
+RUN_BUDGET_SEC = float(os.environ.get('RUN_BUDGET_SEC', 45 * 60))
+ONCE = '--once' in sys.argv[1:]
+
+
+def since_cutoff():
+    return datetime.now(timezone.utc) - timedelta(hours=SINCE_HOURS)
+
+
+class RunBudget:
+    def __init__(self, seconds=RUN_BUDGET_SEC):
+        self.started = time.monotonic()
+        self.deadline = self.started + seconds
+
+    def expired(self):
+        return time.monotonic() >= self.deadline
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+# Only --once runs are bounded; the scheduled mode keeps polling
+budget = RunBudget(RUN_BUDGET_SEC if ONCE else float('inf'))
+
+
+def finish(collector, counts):
+    # counts: {source: rows inserted}. Running out of budget is not an error: the rows are
+    # committed and the next run picks up from the stored watermarks/state.
+    total = sum(counts.values())
+    status = 'budget exhausted' if budget.expired() else 'complete'
+    print(f"{collector}: inserted {total} rows from {len(counts)} sources in {budget.elapsed():.0f}s "
+          f"(last {SINCE_HOURS:g}h, {status})")
+    for source, count in sorted(counts.items()):
+        print(f"  {source}: {count}")
+    sys.exit(0)